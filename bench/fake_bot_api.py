@@ -0,0 +1,190 @@
+# bench/fake_bot_api.py
+"""Stand-in Telegram Bot API server for local load tests.
+
+Implements the subset of methods the bot uses (getMe, getChatMember, getFile, sendMessage, sendDocument,
+sendMediaGroup, deleteMessage(s), editMessageText, answerCallbackQuery, setWebhook, deleteWebhook,
+getUpdates) with configurable latency and injectable 429/error responses; file_ids starting with
+INVALID are always rejected. Every call is recorded so a load generator can measure API calls and
+time-to-last-file per chat.
+
+Standalone: python bench/fake_bot_api.py --port 8081 --latency-ms 40 --rate-limit-ratio 0.01
+Then start the bot with BOT_API_BASE_URL=http://127.0.0.1:8081.
+Updates for polling mode can be injected with POST /_fake/updates (JSON update or list of updates).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+fake_logger = logging.getLogger("fake_bot_api")
+
+# Methods whose responses the injection knobs apply to (setup/polling calls are never failed).
+# file_ids starting with this prefix are rejected like a wrong/expired id (for testing catalog validation).
+INVALID_FILE_PREFIX = 'INVALID'
+FAKE_FILE_SIZE = 350 * 1024 * 1024
+INJECTABLE_METHODS = {'sendMessage', 'sendDocument', 'sendMediaGroup', 'deleteMessage', 'deleteMessages', 'editMessageText', 'getChatMember', 'getFile'}
+
+class FakeBotAPI:
+    def __init__(self, bot_username='fake_file_bot', latency_ms=30.0, jitter_ms=10.0, rate_limit_ratio=0.0,
+                 retry_after=1, error_ratio=0.0, member_ratio=1.0, seed=None):
+        self.bot_username = bot_username
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.rate_limit_ratio, self.retry_after = rate_limit_ratio, retry_after
+        self.error_ratio = error_ratio
+        self.member_ratio = member_ratio
+        self._random = random.Random(seed)
+        self._next_message_id = defaultdict(lambda: 1000) # chat_id -> next message_id
+        self._updates = asyncio.Queue()
+        self._update_id = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.calls = defaultdict(int) # method -> count
+        self.injected = defaultdict(int) # '429' / 'error' -> count
+        self.documents = defaultdict(list) # chat_id -> [monotonic timestamps of delivered documents]
+        self.chat_calls = defaultdict(int) # chat_id -> API calls targeting that chat
+
+    # --- Helpers ---
+    def _message(self, chat_id, **extra):
+        chat_id = int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id
+        message_id = self._next_message_id[chat_id]; self._next_message_id[chat_id] += 1
+        chat_type = 'private' if isinstance(chat_id, int) and chat_id > 0 else 'channel'
+        chat = {'id': chat_id if isinstance(chat_id, int) else -1000000000001, 'type': chat_type}
+        return dict({'message_id': message_id, 'date': int(time.time()), 'chat': chat}, **extra)
+
+    def _document(self, file_id, caption=None):
+        doc = {'document': {'file_id': file_id, 'file_unique_id': file_id[-16:], 'file_size': FAKE_FILE_SIZE, 'mime_type': 'video/x-matroska'}}
+        if caption: doc['caption'] = caption
+        return doc
+
+    def _bot_user(self):
+        return {'id': 424242, 'is_bot': True, 'first_name': 'Fake File Bot', 'username': self.bot_username}
+
+    def next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def enqueue_update(self, update: dict):
+        """Queues an update for getUpdates (polling mode)."""
+        if 'update_id' not in update: update = dict(update, update_id=self.next_update_id())
+        self._updates.put_nowait(update)
+
+    # --- Method implementations ---
+    async def _get_updates(self, params):
+        timeout = min(float(params.get('timeout') or 0), 10.0)
+        updates = []
+        try: updates.append(await asyncio.wait_for(self._updates.get(), timeout=timeout) if timeout else self._updates.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty): return []
+        while not self._updates.empty() and len(updates) < 100: updates.append(self._updates.get_nowait())
+        return updates
+
+    def _result(self, method, params):
+        chat_id = params.get('chat_id')
+        if method == 'getMe': return self._bot_user()
+        if method in ('setWebhook', 'deleteWebhook', 'deleteMessage', 'deleteMessages', 'answerCallbackQuery'): return True
+        if method == 'getWebhookInfo': return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'getChatMember':
+            user_id = int(params.get('user_id'))
+            status = 'member' if self._random.random() < self.member_ratio else 'left'
+            return {'status': status, 'user': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}}
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            return {'file_id': file_id, 'file_unique_id': file_id[-16:], 'file_size': FAKE_FILE_SIZE, 'file_path': f'documents/{file_id[-8:]}.mkv'}
+        if method == 'sendMessage': return self._message(chat_id, text=params.get('text', ''))
+        if method == 'editMessageText': return self._message(chat_id or 0, text=params.get('text', ''))
+        if method == 'sendDocument':
+            self.documents[str(chat_id)].append(time.monotonic())
+            return self._message(chat_id, **self._document(params.get('document'), params.get('caption')))
+        if method == 'sendMediaGroup':
+            media = params.get('media') or []
+            now = time.monotonic()
+            self.documents[str(chat_id)].extend([now] * len(media))
+            return [self._message(chat_id, **self._document(m.get('media'), m.get('caption'))) for m in media]
+        raise web.HTTPNotFound(text=json.dumps({'ok': False, 'error_code': 404, 'description': f'Not Found: method {method} not implemented'}))
+
+    async def handle(self, request: web.Request):
+        method = request.match_info['method']
+        if request.content_type == 'application/json': params = await request.json()
+        else:
+            params = dict(await request.post())
+            for key in ('media', 'message_ids', 'reply_markup', 'allowed_updates'):
+                if isinstance(params.get(key), str):
+                    try: params[key] = json.loads(params[key])
+                    except ValueError: pass
+        self.calls[method] += 1
+        if params.get('chat_id') is not None: self.chat_calls[str(params['chat_id'])] += 1
+        if method == 'getUpdates': return web.json_response({'ok': True, 'result': await self._get_updates(params)})
+
+        if self.latency_ms > 0:
+            await asyncio.sleep(max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+        if method in INJECTABLE_METHODS:
+            roll = self._random.random()
+            if roll < self.rate_limit_ratio:
+                self.injected['429'] += 1
+                return web.json_response({'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {self.retry_after}',
+                                          'parameters': {'retry_after': self.retry_after}}, status=429)
+            if roll < self.rate_limit_ratio + self.error_ratio:
+                self.injected['error'] += 1
+                return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: wrong file identifier/HTTP URL specified'}, status=400)
+        file_ids = [params.get('file_id'), params.get('document')] + [m.get('media') for m in params.get('media') or [] if isinstance(m, dict)]
+        if any(isinstance(f, str) and f.startswith(INVALID_FILE_PREFIX) for f in file_ids):
+            return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: wrong file identifier/HTTP URL specified'}, status=400)
+        return web.json_response({'ok': True, 'result': self._result(method, params)})
+
+    async def handle_inject(self, request: web.Request):
+        payload = await request.json()
+        for update in (payload if isinstance(payload, list) else [payload]): self.enqueue_update(update)
+        return web.json_response({'ok': True})
+
+    async def handle_stats(self, request: web.Request):
+        return web.json_response({'calls': dict(self.calls), 'injected': dict(self.injected),
+                                  'documents': {chat: len(ts) for chat, ts in self.documents.items()}})
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        app.router.add_post('/_fake/updates', self.handle_inject)
+        app.router.add_get('/_fake/stats', self.handle_stats)
+        return app
+
+    async def start(self, host='127.0.0.1', port=8081) -> web.AppRunner:
+        runner = web.AppRunner(self.build_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        fake_logger.info(f"Fake Bot API listening on http://{host}:{port}")
+        return runner
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency-ms', type=float, default=30.0, help='Mean per-call latency.')
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help='Std-dev of per-call latency.')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='Fraction of calls answered with 429.')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after seconds in injected 429s.')
+    parser.add_argument('--error-ratio', type=float, default=0.0, help='Fraction of calls answered with a 400 error.')
+    parser.add_argument('--member-ratio', type=float, default=1.0, help='Fraction of getChatMember calls that report membership.')
+    parser.add_argument('--bot-username', default='fake_file_bot')
+    parser.add_argument('--seed', type=int, default=None)
+
+def from_arguments(args) -> FakeBotAPI:
+    return FakeBotAPI(args.bot_username, args.latency_ms, args.jitter_ms, args.rate_limit_ratio,
+                      args.retry_after, args.error_ratio, args.member_ratio, args.seed)
+
+async def _serve_forever(api: FakeBotAPI, host: str, port: int):
+    runner = await api.start(host, port)
+    try: await asyncio.Event().wait()
+    finally: await runner.cleanup()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+    try: asyncio.run(_serve_forever(from_arguments(args), args.host, args.port))
+    except KeyboardInterrupt: pass
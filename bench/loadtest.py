@@ -0,0 +1,216 @@
+# bench/loadtest.py
+"""Load test for the delivery pipeline (start_handler -> membership check -> send_files_to_user).
+
+Starts the fake Bot API in-process, launches telegram_bot2.py as a subprocess pointed at it,
+simulates N users sending "/start <content_key>" and reports time-to-last-file percentiles,
+API calls per request, peak RSS and CPU of the bot process. Results are written as JSON to
+bench/results/ so runs can be compared across commits.
+
+Example: python bench/loadtest.py --users 200 --mode webhook --latency-ms 40
+With --workers N the bot runs as N processes sharing one state DB (worker 0 is the ingress on --bot-port,
+worker i listens on --bot-port + i), which exercises update sharding and the leader lease.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fake_bot_api import add_arguments, from_arguments # noqa: E402
+from catalog import build_index # noqa: E402
+
+load_logger = logging.getLogger("loadtest")
+
+BOT_TOKEN = '123456:FAKE-LOADTEST-TOKEN'
+WEBHOOK_SECRET = 'loadtest-secret'
+PUBLIC_CHANNEL_ID = '-1001234567890'
+BASE_USER_ID = 700000000
+
+def percentile(values, pct):
+    if not values: return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[rank], 4)
+
+def start_update(user_id: int, content_key: str) -> dict:
+    return {'message': {
+        'message_id': 1, 'date': int(time.time()), 'text': f'/start {content_key}',
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'last_name': str(user_id)},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+    }}
+
+def read_peak_rss_kb(pid: int):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): return int(line.split()[1])
+    except OSError: return None
+
+def parse_metric(text: str, name: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(name + ' '): return float(line.split()[1])
+    return 0.0
+
+async def scrape_metrics(session, ports) -> list:
+    texts = []
+    for port in ports:
+        async with session.get(f'http://127.0.0.1:{port}/metrics') as resp: texts.append(await resp.text())
+    return texts
+
+async def deliveries_settled(session, ports, users: int) -> bool:
+    """True once the bot processes have handled every /start and have no delivery running (covers failed/incomplete ones).
+
+    Counts finished start handlers, not started ones: a handler still waiting on its membership check has no delivery yet.
+    """
+    try: texts = await scrape_metrics(session, ports)
+    except aiohttp.ClientError: return False
+    handled = sum(parse_metric(t, 'bot_handler_duration_seconds_count{handler="start_handler"}') for t in texts)
+    return handled >= users and all(parse_metric(t, 'bot_deliveries_in_flight') == 0 for t in texts)
+
+def git_commit():
+    try: return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except Exception: return None
+
+async def wait_until_ready(session, url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200: return
+        except aiohttp.ClientError: pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"bot did not become ready at {url} within {timeout}s")
+
+async def run(args) -> dict:
+    catalog_path = args.catalog or os.path.join(REPO_DIR, 'catalog.json')
+    with open(catalog_path, encoding='utf-8') as f: entry = build_index(json.load(f), 20).entries.get(args.content_key)
+    if not entry or not entry.file_ids: raise SystemExit(f"content key '{args.content_key}' has no files in {catalog_path}")
+    expected = len(entry.file_ids)
+
+    api = from_arguments(args)
+    api_runner = await api.start('127.0.0.1', args.api_port)
+    state_dir = tempfile.mkdtemp(prefix='loadtest-')
+    env = dict(os.environ,
+        BOT_TOKEN=BOT_TOKEN, BOT_USERNAME=args.bot_username, PUBLIC_CHANNEL_ID=PUBLIC_CHANNEL_ID,
+        BOT_API_BASE_URL=f'http://127.0.0.1:{args.api_port}', BOT_MODE=args.mode, PORT=str(args.bot_port),
+        WEBHOOK_URL=f'http://127.0.0.1:{args.bot_port}', WEBHOOK_SECRET_TOKEN=WEBHOOK_SECRET,
+        STATE_DB_PATH=os.path.join(state_dir, 'bot_state.sqlite3'), CATALOG_PATH=catalog_path,
+    )
+    for pair in args.bot_env: key, _, value = pair.partition('='); env[key] = value
+    ports = [args.bot_port + i for i in range(args.workers)]
+    bots = [subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'telegram_bot2.py')], cwd=REPO_DIR,
+                             env=dict(env, PORT=str(port), WORKER_INDEX=str(i), WORKER_COUNT=str(args.workers)),
+                             stdout=subprocess.DEVNULL if not args.bot_logs else None, stderr=subprocess.STDOUT if not args.bot_logs else None)
+            for i, port in enumerate(ports)]
+    results = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            startup_started = time.monotonic()
+            for port in ports: await wait_until_ready(session, f'http://127.0.0.1:{port}/ready')
+            startup_seconds = time.monotonic() - startup_started
+            await asyncio.sleep(args.settle_seconds) # Let post-init chores (portal message, replays) finish
+            startup_calls = dict(api.calls)
+            api.reset_stats()
+
+            submitted = {}
+            async def submit(user_id):
+                update = start_update(user_id, args.content_key)
+                submitted[str(user_id)] = time.monotonic()
+                if args.mode == 'webhook':
+                    update['update_id'] = api.next_update_id()
+                    async with session.post(f'http://127.0.0.1:{args.bot_port}/telegram-webhook', json=update,
+                                            headers={'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}) as resp:
+                        if resp.status != 200: load_logger.warning(f"webhook returned {resp.status} for user {user_id}")
+                else: api.enqueue_update(update)
+
+            run_started = time.monotonic()
+            users = [BASE_USER_ID + i for i in range(args.users)]
+            for user_id in users:
+                await submit(user_id)
+                if args.ramp_seconds: await asyncio.sleep(args.ramp_seconds / args.users)
+
+            deadline = time.monotonic() + args.timeout
+            next_settle_check = 0.0
+            while time.monotonic() < deadline:
+                if all(len(api.documents.get(str(u), ())) >= expected for u in users): break
+                if time.monotonic() >= next_settle_check:
+                    if await deliveries_settled(session, ports, args.users): break
+                    next_settle_check = time.monotonic() + 0.5
+                await asyncio.sleep(0.05)
+            wall_seconds = time.monotonic() - run_started
+            texts = await scrape_metrics(session, ports)
+
+        latencies = [api.documents[str(u)][expected - 1] - submitted[str(u)] for u in users if len(api.documents.get(str(u), ())) >= expected]
+        calls = {m: c for m, c in api.calls.items() if m != 'getUpdates'}
+        results = {
+            'users': args.users, 'completed': len(latencies), 'incomplete': args.users - len(latencies),
+            'files_per_request': expected, 'wall_seconds': round(wall_seconds, 3), 'startup_seconds': round(startup_seconds, 3),
+            'time_to_last_file_s': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95), 'p99': percentile(latencies, 99),
+                                    'max': round(max(latencies), 4) if latencies else None},
+            'api_calls_per_request': round(sum(calls.values()) / args.users, 3),
+            'api_calls_by_method': calls, 'startup_api_calls': {m: c for m, c in startup_calls.items() if m != 'getUpdates'},
+            'injected': dict(api.injected), 'bot_peak_rss_kb': sum(read_peak_rss_kb(b.pid) or 0 for b in bots) or None,
+            'workers': args.workers, 'starts_by_worker': [int(parse_metric(t, 'bot_starts_total')) for t in texts],
+            'leaders': sum(int(parse_metric(t, 'bot_is_leader')) for t in texts),
+            'bot_startup_seconds': [parse_metric(t, 'bot_startup_seconds') for t in texts], # As measured by each bot process
+        }
+    finally:
+        for bot in bots: bot.terminate()
+        for bot in bots:
+            try: bot.wait(timeout=20)
+            except subprocess.TimeoutExpired: bot.kill(); bot.wait()
+        await api_runner.cleanup()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results['bot_cpu_seconds'] = round(usage.ru_utime + usage.ru_stime, 3)
+    if results.get('bot_peak_rss_kb') is None: results['bot_peak_rss_kb'] = usage.ru_maxrss # Linux reports kB
+    return results
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100, help='Simulated users, one /start each.')
+    parser.add_argument('--ramp-seconds', type=float, default=0.0, help='Spread submissions over this many seconds (0 = burst).')
+    parser.add_argument('--content-key', default='apothecary_diaries_s1')
+    parser.add_argument('--catalog', default=None, help='Catalog JSON (default: repo catalog.json).')
+    parser.add_argument('--mode', choices=('webhook', 'polling'), default='webhook')
+    parser.add_argument('--api-port', type=int, default=18079)
+    parser.add_argument('--bot-port', type=int, default=18080)
+    parser.add_argument('--workers', type=int, default=1, help='Bot processes sharing one state DB (ports --bot-port .. --bot-port + N - 1).')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Give up on unfinished deliveries after this many seconds.')
+    parser.add_argument('--settle-seconds', type=float, default=3.0)
+    parser.add_argument('--bot-env', action='append', default=[], metavar='KEY=VALUE', help='Extra env for the bot process (repeatable).')
+    parser.add_argument('--bot-logs', action='store_true', help="Show the bot's own log output.")
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results'), help='Directory for the JSON result file.')
+    parser.add_argument('--label', default=None, help='Optional label stored in the result and file name.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    commit = git_commit()
+    report = {
+        'label': args.label, 'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output',)}, 'results': results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    name = '-'.join(p for p in (time.strftime('%Y%m%d-%H%M%S'), commit, args.mode, args.label) if p)
+    path = os.path.join(args.output, f'{name}.json')
+    with open(path, 'w') as f: json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    load_logger.info(f"Results written to {path}")
+
+if __name__ == '__main__':
+    main()
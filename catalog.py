@@ -0,0 +1,148 @@
+# catalog.py
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+from telegram.helpers import escape_markdown
+
+catalog_logger = logging.getLogger("catalog")
+
+PLACEHOLDER_PREFIX = 'FILE_ID_'
+# Keys travel in /start deep links (max 64 chars) and in "retry_<key>"/"resume_<key>" callback data (max 64 bytes).
+KEY_PATTERN = re.compile(r'^[a-z0-9_]{1,57}$')
+
+class CatalogEntry:
+    """One season with every string the delivery path needs, rendered once at load time."""
+    __slots__ = ('key', 'display_name', 'file_ids', 'part_numbers', 'escaped_name', 'captions', 'announcement_text', 'unavailable_text',
+                 'button_text', 'delete_after_minutes')
+
+    def __init__(self, key: str, display_name: str, parts: tuple, delete_after_minutes: int):
+        """`parts` is ((part_number, file_id), ...); numbers keep their place in the source list, so a dropped duplicate leaves a gap."""
+        self.key = key
+        self.display_name = display_name
+        self.part_numbers = tuple(number for number, _ in parts)
+        self.file_ids = tuple(fid for _, fid in parts)
+        self.delete_after_minutes = delete_after_minutes
+        self.escaped_name = escape_markdown(display_name, version=2)
+        self.captions = tuple(f"{display_name} - Part {number}" for number in self.part_numbers) # plain text
+        self.announcement_text = self._announcement(len(self.file_ids))
+        self.unavailable_text = f"🚧 Files for '{self.escaped_name}' not available yet\\."
+        self.button_text = f"🎬 {display_name}"
+
+    def _announcement(self, count: int) -> str:
+        return (
+            f"✅ Great\\! Sending {count} file\\(s\\) for '{self.escaped_name}'\\.\n\n"
+            f"🕒 _These files auto\\-delete in {self.delete_after_minutes} mins\\._" # Italic is with single underscores in MDv2
+        )
+
+    def announcement(self, count: int) -> str:
+        """Announcement for a first delivery of `count` parts (fewer than all when known-bad parts are skipped)."""
+        return self.announcement_text if count == len(self.file_ids) else self._announcement(count)
+
+    def remaining_text(self, remaining: int, available: int = None) -> str:
+        """Announcement for a resumed delivery that only sends the parts the user is missing, out of `available` sendable ones."""
+        return (
+            f"✅ Sending the remaining {remaining} of {available or len(self.file_ids)} file\\(s\\) for '{self.escaped_name}'\\.\n\n"
+            f"🕒 _These files auto\\-delete in {self.delete_after_minutes} mins\\._"
+        )
+
+    def delivered_text(self, available: int = None) -> str:
+        return f"✅ You already have all {available or len(self.file_ids)} file\\(s\\) for '{self.escaped_name}', check the messages above\\."
+
+class CatalogIndex:
+    """Immutable snapshot of the catalog. Reloads build a new index and swap it in as a whole."""
+
+    def __init__(self, entries: dict, version: str, source_stamp=None, raw=None, duplicates=()):
+        self.entries = entries
+        self.duplicates = duplicates # [(key, part_number, first_part_number)] dropped because the file_id was already listed
+        self.raw = raw # The parsed file this was built from, kept for the startup snapshot
+        self.available_keys = tuple(sorted(k for k, e in entries.items() if e.file_ids))
+        self.version = version
+        self.source_stamp = source_stamp
+        self.loaded_at = time.time()
+
+def build_index(raw: dict, delete_after_minutes: int, source_stamp=None) -> CatalogIndex:
+    """Validates raw catalog data ({"seasons": {key: {"display_name", "file_ids"}}}) into an index."""
+    seasons = raw.get('seasons') if isinstance(raw, dict) else None
+    if not isinstance(seasons, dict): raise ValueError("catalog must contain a 'seasons' object")
+    entries, duplicates = {}, []
+    for raw_key, spec in seasons.items():
+        key = str(raw_key).lower()
+        if not KEY_PATTERN.match(key):
+            catalog_logger.warning("Skipping catalog key '%s': must match %s.", raw_key, KEY_PATTERN.pattern)
+            continue
+        if not isinstance(spec, dict): catalog_logger.warning("Skipping catalog key '%s': entry is not an object.", key); continue
+        display_name = str(spec.get('display_name') or key.replace('_', ' ').title())
+        seen, parts = {}, [] # seen: file_id -> part number of its first occurrence
+        valid = (fid.strip() for fid in spec.get('file_ids') or [] if isinstance(fid, str) and fid.strip() and not fid.startswith(PLACEHOLDER_PREFIX))
+        for number, fid in enumerate(valid, 1):
+            if fid in seen:
+                catalog_logger.warning("Catalog '%s': dropping Part %d, a duplicate of Part %d (%s...).", key, number, seen[fid], fid[:16])
+                duplicates.append((key, number, seen[fid]))
+                continue
+            seen[fid] = number; parts.append((number, fid))
+        entries[key] = CatalogEntry(key, display_name, tuple(parts), delete_after_minutes)
+    version = hashlib.sha256(json.dumps(raw, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:12]
+    return CatalogIndex(entries, version, source_stamp, raw, duplicates)
+
+class Catalog:
+    """Content catalog backed by a JSON file, served from a precomputed in-memory index.
+
+    `reload()` re-reads the file only when its mtime/size changed, and keeps serving the
+    previous index if the new file is invalid. Callers should grab an entry once per
+    delivery (`get`) so a concurrent reload never changes a delivery halfway through.
+    """
+
+    def __init__(self, path: str, delete_after_minutes: int):
+        self.path = path
+        self.delete_after_minutes = delete_after_minutes
+        self._index = CatalogIndex({}, 'empty')
+
+    @property
+    def index(self) -> CatalogIndex:
+        return self._index
+
+    def get(self, key: str):
+        return self._index.entries.get(key)
+
+    def __contains__(self, key):
+        return key in self._index.entries
+
+    def _stamp(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def adopt(self, raw, stamp) -> bool:
+        """Builds the index from catalog data saved by an earlier run (the startup snapshot) if the file hasn't changed since.
+
+        Only the file read and parse are skipped; the strings are always rendered by the current code.
+        """
+        try:
+            current = self._stamp()
+            if raw is None or tuple(stamp or ()) != current: return False
+            self._index = build_index(raw, self.delete_after_minutes, current)
+        except Exception as e:
+            catalog_logger.warning("Ignoring snapshot catalog data: %s", e)
+            return False
+        return True
+
+    def reload(self, force: bool = False) -> bool:
+        """Reloads the catalog if the file changed (or `force`). Returns True if a new index was swapped in."""
+        try:
+            stamp = self._stamp()
+            if not force and stamp == self._index.source_stamp: return False
+            with open(self.path, encoding='utf-8') as f: raw = json.load(f)
+            new_index = build_index(raw, self.delete_after_minutes, stamp)
+        except Exception as e:
+            catalog_logger.error("Catalog reload from %s failed; keeping version %s: %s", self.path, self._index.version, e)
+            return False
+        old_version = self._index.version
+        self._index = new_index # single reference swap; readers see either the old or the new index
+        if new_index.version != old_version:
+            catalog_logger.info("Catalog loaded from %s: version %s, %s entries, %s available.", self.path, new_index.version, len(new_index.entries),
+                                len(new_index.available_keys), extra={'count': len(new_index.entries)})
+            return True
+        return False
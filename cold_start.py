@@ -0,0 +1,78 @@
+# cold_start.py
+import hashlib
+import json
+import logging
+import os
+import time
+
+from telegram import User
+from telegram.ext import ExtBot
+
+cold_start_logger = logging.getLogger("cold_start")
+
+SNAPSHOT_VERSION = 2
+
+class StartupTimer:
+    """Records how long each startup phase took, measured from `started` (a time.perf_counter() value)."""
+
+    def __init__(self, started: float = None):
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self.phases = [] # [(name, seconds)]
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def report(self) -> str:
+        parts = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases)
+        return f"Startup: ready in {self.total * 1000:.0f}ms ({parts})."
+
+def token_fingerprint(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+def load_snapshot(path: str, token: str) -> dict:
+    """Returns the snapshot written by a previous run for the same token, or {} if there is none (or it's unusable)."""
+    try:
+        with open(path, encoding='utf-8') as f: snapshot = json.load(f)
+    except FileNotFoundError: return {}
+    except Exception as e:
+        cold_start_logger.warning("Ignoring unreadable startup snapshot %s: %s", path, e)
+        return {}
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('token') != token_fingerprint(token): return {}
+    return snapshot
+
+def save_snapshot(path: str, token: str, bot_user: dict = None, catalog_raw: dict = None, catalog_stamp=None):
+    """Atomically writes the bot identity and the raw catalog (with its file stamp) as JSON for the next cold start."""
+    snapshot = {'version': SNAPSHOT_VERSION, 'token': token_fingerprint(token), 'bot_user': bot_user,
+                'catalog': {'raw': catalog_raw, 'stamp': list(catalog_stamp) if catalog_stamp else None}}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        cold_start_logger.warning("Could not write startup snapshot %s: %s", path, e)
+        try: os.remove(tmp_path)
+        except OSError: pass
+
+class SnapshotBot(ExtBot):
+    """ExtBot whose first get_me() (the one inside initialize()) is answered from the snapshot, saving a round trip.
+
+    Later calls go to the API as usual; the caller should verify the identity with a real get_me() once serving.
+    """
+
+    def __init__(self, *args, cached_me: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_me = cached_me
+
+    async def get_me(self, *args, **kwargs) -> User:
+        if self._cached_me is not None:
+            data, self._cached_me = self._cached_me, None
+            self._bot_user = User.de_json(data, self)
+            return self._bot_user
+        return await super().get_me(*args, **kwargs)
@@ -0,0 +1,71 @@
+# deletion_ledger.py
+import logging
+import sqlite3
+import time
+
+ledger_logger = logging.getLogger("deletion_ledger")
+
+class DeletionLedger:
+    """Persistent schedule of messages to auto-delete, stored in SQLite so it survives restarts.
+
+    Rows are (chat_id, message_id, delete_at); a single periodic sweep asks for everything
+    that is due, grouped per chat, and removes rows once they have been handled.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn # Owned by SQLiteBackend (autocommit), which serializes calls and sets the busy timeout
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_deletions ("
+            " chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL,"
+            " delete_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (chat_id, message_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_deletions_due ON pending_deletions (delete_at)")
+
+    def schedule(self, chat_id: int, message_ids, delete_at: float):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO pending_deletions (chat_id, message_id, delete_at) VALUES (?, ?, ?)",
+            [(chat_id, mid, delete_at) for mid in message_ids]
+        )
+
+    def due(self, now: float = None, limit: int = 5000) -> dict:
+        """Returns {chat_id: [message_id, ...]} for entries whose delete_at has passed."""
+        rows = self._conn.execute(
+            "SELECT chat_id, message_id FROM pending_deletions WHERE delete_at <= ? ORDER BY delete_at LIMIT ?",
+            (time.time() if now is None else now, limit)
+        ).fetchall()
+        grouped = {}
+        for chat_id, message_id in rows: grouped.setdefault(chat_id, []).append(message_id)
+        return grouped
+
+    def remove(self, chat_id: int, message_ids):
+        self._conn.executemany(
+            "DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ?",
+            [(chat_id, mid) for mid in message_ids]
+        )
+
+    def defer(self, chat_id: int, message_ids, delete_at: float, max_attempts: int = 5) -> int:
+        """Pushes entries back after a transient failure; drops those that exhausted max_attempts. Returns dropped count."""
+        message_ids = list(message_ids)
+        if not message_ids: return 0
+        params = [(chat_id, mid) for mid in message_ids]
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "UPDATE pending_deletions SET attempts = attempts + 1, delete_at = ? WHERE chat_id = ? AND message_id = ?",
+                [(delete_at, c, m) for c, m in params]
+            )
+            dropped = self._conn.execute(
+                f"DELETE FROM pending_deletions WHERE chat_id = ? AND attempts >= ? AND message_id IN ({','.join('?' * len(params))})",
+                (chat_id, max_attempts, *message_ids)
+            ).rowcount
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return dropped
+
+    def pending_count(self, overdue_only: bool = False) -> int:
+        if overdue_only:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_deletions WHERE delete_at <= ?", (time.time(),)).fetchone()[0]
+        return self._conn.execute("SELECT COUNT(*) FROM pending_deletions").fetchone()[0]
@@ -0,0 +1,69 @@
+# delivery_coordinator.py
+import asyncio
+import logging
+import time
+
+coordinator_logger = logging.getLogger("delivery_coordinator")
+
+STARTED, IN_FLIGHT, COOLDOWN = 'started', 'in_flight', 'cooldown'
+
+class DeliveryCoordinator:
+    """Runs deliveries as tracked background tasks, at most one per (user_id, content_key).
+
+    While a delivery is running, further requests for the same key are refused with IN_FLIGHT;
+    for `cooldown` seconds after it completes they are refused with COOLDOWN. A delivery whose
+    coroutine returns False (some parts missing) gets no cooldown, so the rest can be fetched
+    right away. The check and the reservation happen without an await in between, so concurrent
+    handlers can't both win.
+    """
+
+    def __init__(self, cooldown: float = 60, clock=time.monotonic):
+        self.cooldown = cooldown
+        self._clock = clock
+        self._tasks = {} # key -> asyncio.Task
+        self._finished_at = {} # key -> clock() when the last delivery ended
+        self.started = 0
+        self.coalesced = 0
+
+    def status(self, key):
+        """Returns (IN_FLIGHT|COOLDOWN|None, seconds_left) without reserving anything."""
+        if key in self._tasks: return IN_FLIGHT, 0.0
+        finished_at = self._finished_at.get(key)
+        if finished_at is not None:
+            left = finished_at + self.cooldown - self._clock()
+            if left > 0: return COOLDOWN, left
+            del self._finished_at[key]
+        return None, 0.0
+
+    def launch(self, key, coro_factory, create_task=None):
+        """Starts `coro_factory()` as a task unless `key` is busy. Returns (STARTED|IN_FLIGHT|COOLDOWN, seconds_left)."""
+        state, left = self.status(key)
+        if state is not None:
+            self.coalesced += 1
+            return state, left
+        task = (create_task or asyncio.get_running_loop().create_task)(self._run(key, coro_factory))
+        self._tasks[key] = task
+        self.started += 1
+        return STARTED, 0.0
+
+    async def _run(self, key, coro_factory):
+        completed = False
+        try: completed = await coro_factory() is not False
+        except asyncio.CancelledError: raise
+        except Exception as e: coordinator_logger.error("Delivery %s failed: %s", key, e, exc_info=True)
+        finally:
+            self._tasks.pop(key, None)
+            if completed and self.cooldown > 0: self._finished_at[key] = self._clock()
+            self._prune()
+
+    def _prune(self):
+        if len(self._finished_at) < 1024: return
+        now = self._clock()
+        for key in [k for k, t in self._finished_at.items() if t + self.cooldown <= now]: del self._finished_at[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> dict:
+        return {'in_flight': self.in_flight, 'started': self.started, 'coalesced': self.coalesced, 'cooling_down': len(self._finished_at)}
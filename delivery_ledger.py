@@ -0,0 +1,49 @@
+# delivery_ledger.py
+import sqlite3
+import time
+
+PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+
+class DeliveryLedger:
+    """Per-user record of which parts of a season were delivered, stored in SQLite.
+
+    Parts are keyed by file_id rather than position, so a catalog edit doesn't mix them up.
+    A 'sent' row only counts while the message still exists (callers pass `fresh_since`),
+    and 'pending' rows left behind by a crash mark deliveries to resume on startup.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn # Owned by SQLiteBackend, like the other stores
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS delivery_parts ("
+            " user_id INTEGER NOT NULL, content_key TEXT NOT NULL, file_id TEXT NOT NULL,"
+            " part INTEGER NOT NULL, chat_id INTEGER NOT NULL, status TEXT NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (user_id, content_key, file_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_delivery_parts_status ON delivery_parts (status, updated_at)")
+
+    def missing_parts(self, user_id: int, content_key: str, file_ids, fresh_since: float) -> list:
+        """Indexes into `file_ids` that have no 'sent' row newer than `fresh_since`."""
+        delivered = {row[0] for row in self._conn.execute(
+            "SELECT file_id FROM delivery_parts WHERE user_id = ? AND content_key = ? AND status = ? AND updated_at >= ?",
+            (user_id, content_key, SENT, fresh_since)
+        )}
+        return [i for i, fid in enumerate(file_ids) if fid not in delivered]
+
+    def mark(self, user_id: int, chat_id: int, content_key: str, parts, status: str):
+        """Sets `status` (PENDING/SENT/FAILED) for `parts`, an iterable of (index, file_id)."""
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO delivery_parts (user_id, content_key, file_id, part, chat_id, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, content_key, fid, index, chat_id, status, now) for index, fid in parts]
+        )
+
+    def unfinished(self, since: float) -> list:
+        """(user_id, chat_id, content_key) of deliveries interrupted mid-way (pending rows newer than `since`)."""
+        return self._conn.execute(
+            "SELECT DISTINCT user_id, chat_id, content_key FROM delivery_parts WHERE status = ? AND updated_at >= ?",
+            (PENDING, since)
+        ).fetchall()
+
+    def prune(self, before: float) -> int:
+        return self._conn.execute("DELETE FROM delivery_parts WHERE updated_at < ?", (before,)).rowcount
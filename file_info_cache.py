@@ -0,0 +1,82 @@
+# file_info_cache.py
+import sqlite3
+import time
+from collections import namedtuple
+
+FileInfo = namedtuple('FileInfo', 'ok size mime error checked_at')
+
+def format_size(num_bytes: int) -> str:
+    size = float(num_bytes)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB': return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+class FileInfoStore:
+    """The file_info table in the SQLite state DB (SQLiteBackend's storage for FileInfoCache)."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn # Owned by SQLiteBackend, like the other stores
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_info ("
+            " file_id TEXT PRIMARY KEY, ok INTEGER NOT NULL, size INTEGER, mime TEXT, error TEXT, checked_at REAL NOT NULL)"
+        )
+
+    def load(self) -> dict:
+        rows = self._conn.execute("SELECT file_id, ok, size, mime, error, checked_at FROM file_info")
+        return {fid: FileInfo(bool(ok), size, mime, error, checked_at) for fid, ok, size, mime, error, checked_at in rows}
+
+    def save(self, file_id: str, info: FileInfo):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO file_info (file_id, ok, size, mime, error, checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (file_id, int(info.ok), info.size, info.mime, info.error, info.checked_at)
+        )
+
+class FileInfoCache:
+    """What the bot knows about each file_id (valid or not, size, mime type), kept in the state backend.
+
+    Filled by startup/admin validation (getFile) and by the Document objects that come back
+    from successful sends, so a restart doesn't re-check anything. Everything is mirrored in
+    memory; lookups on the delivery path never touch the backend. `record` only updates the
+    mirror and returns what the caller should persist.
+    """
+
+    def __init__(self):
+        self._infos = {}
+
+    def load(self, infos: dict):
+        """Replaces the mirror with {file_id: FileInfo} read from the backend, e.g. to pick up another instance's results."""
+        self._infos = dict(infos)
+
+    def get(self, file_id: str):
+        return self._infos.get(file_id)
+
+    def is_bad(self, file_id: str) -> bool:
+        info = self._infos.get(file_id)
+        return info is not None and not info.ok
+
+    def size(self, file_id: str):
+        info = self._infos.get(file_id)
+        return info.size if info else None
+
+    def unchecked(self, file_ids) -> list:
+        return [fid for fid in file_ids if fid not in self._infos]
+
+    def bad(self) -> dict:
+        """{file_id: error} for every file_id known to be invalid."""
+        return {fid: info.error for fid, info in self._infos.items() if not info.ok}
+
+    def record(self, file_id: str, ok: bool, size: int = None, mime: str = None, error: str = None):
+        """Stores a check/send result and returns the FileInfo to persist, or None if nothing new was learned.
+
+        A missing size or mime keeps whatever was known before.
+        """
+        old = self._infos.get(file_id)
+        if old and old.ok and ok:
+            size = size if size is not None else old.size
+            mime = mime or old.mime
+            if (size, mime) == (old.size, old.mime): return None
+        info = self._infos[file_id] = FileInfo(ok, size, mime, error, time.time())
+        return info
+
+    def __len__(self):
+        return len(self._infos)
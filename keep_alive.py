@@ -1,38 +1,65 @@
 # keep_alive.py
-from flask import Flask
-from threading import Thread
+import hmac
 import logging
 import os
 
-# Use a specific logger for keep_alive or reuse main app's logger if configured early
+from aiohttp import web
+
+from log_setup import configure_logging
+
+# Use a specific logger for keep_alive; output goes through the shared non-blocking pipeline
 ka_logger = logging.getLogger("keep_alive_server") # Specific name
-if not ka_logger.handlers: # Basic config if not already set by main app
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_logging() # No-op if the main app already configured logging
+
+HEALTH_TEXT = "File Share Bot is active and alive!"
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+async def home(request: web.Request):
+    ka_logger.info("Keep-alive endpoint '/' was pinged.", extra={'sample': 'ping'})
+    return web.Response(text=HEALTH_TEXT)
+
+async def ready(request: web.Request):
+    ready_check = request.app['ready_check']
+    if ready_check is None or ready_check(): return web.Response(text="ready")
+    return web.Response(status=503, text="starting")
+
+async def metrics(request: web.Request):
+    return web.Response(body=request.app['metrics_renderer']().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
 
-app = Flask(__name__) # Use __name__ for Flask app
+async def telegram_webhook(request: web.Request):
+    secret = request.app['webhook_secret']
+    if secret and not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), secret):
+        ka_logger.warning("Rejected webhook call from %s: bad secret token.", request.remote)
+        return web.Response(status=403)
+    try: data = await request.json()
+    except ValueError: return web.Response(status=400)
+    try: await request.app['on_update'](data)
+    except Exception as e:
+        ka_logger.error("Failed to enqueue webhook update: %s", e, exc_info=True)
+        return web.Response(status=500) # Telegram will redeliver
+    return web.Response()
 
-@app.route('/')
-def home():
-    ka_logger.info("Keep-alive endpoint '/' was pinged.")
-    return "File Share Bot is active and alive!"
+def build_web_app(ready_check=None, webhook_path: str = None, webhook_secret: str = None, on_update=None, metrics_renderer=None) -> web.Application:
+    """Health ('/'), readiness ('/ready'), Prometheus '/metrics' if `metrics_renderer` is given, and the Telegram webhook if `webhook_path` is."""
+    app = web.Application()
+    app['ready_check'] = ready_check
+    app['webhook_secret'] = webhook_secret
+    app['on_update'] = on_update
+    app['metrics_renderer'] = metrics_renderer
+    app.router.add_get('/', home)
+    app.router.add_get('/ready', ready)
+    if metrics_renderer: app.router.add_get('/metrics', metrics)
+    if webhook_path:
+        if on_update is None: raise ValueError("on_update is required when webhook_path is set")
+        app.router.add_post(webhook_path, telegram_webhook)
+    return app
 
-def run_flask_app():
-  try:
+async def start_web_server(app: web.Application, host: str = '0.0.0.0', port: int = None) -> web.AppRunner:
+    """Serves `app` on the running event loop. Call `await runner.cleanup()` to stop."""
     # Render and some other platforms set a PORT environment variable
-    port = int(os.environ.get("PORT", 8080)) # Default to 8080 if PORT not set
-    ka_logger.info(f"Starting Flask keep-alive server on host 0.0.0.0, port {port}...")
-    # Use a production-grade WSGI server if this were a more complex web app,
-    # but for a simple keep-alive ping, Flask's dev server is often sufficient
-    # and simpler on platforms like Replit/Render that manage the external interface.
-    app.run(host='0.0.0.0', port=port)
-    ka_logger.info("Flask keep-alive server has stopped.") # Should not typically be reached
-  except Exception as e:
-    ka_logger.error(f"Flask keep-alive server encountered an error: {e}", exc_info=True)
-
-def keep_alive():
-    """Starts the Flask app in a separate daemon thread."""
-    ka_logger.info("Initializing keep_alive thread...")
-    flask_thread = Thread(target=run_flask_app)
-    flask_thread.daemon = True  # Ensure thread doesn't block program exit
-    flask_thread.start()
-    ka_logger.info("Keep_alive thread started.")
+    port = port or int(os.environ.get("PORT", 8080)) # Default to 8080 if PORT not set
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    ka_logger.info("Web server listening on host %s, port %s.", host, port)
+    return runner
@@ -0,0 +1,99 @@
+# log_setup.py
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Structured fields copied from `extra={...}` into JSON output when present.
+CONTEXT_FIELDS = ('user_id', 'chat_id', 'content_key', 'latency_ms', 'count', 'suppressed')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line. Runs on the listener thread, so %-args are only merged there."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': round(record.created, 3), 'level': record.levelname, 'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None: payload[field] = value
+        if record.exc_info: payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that enqueues the record untouched.
+
+    The stock prepare() formats the message on the calling thread; here formatting is left
+    to the listener, so the event loop only pays for creating the record.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Rate-limits records tagged with extra={'sample': '<key>'} to `per_second` per key.
+
+    WARNING and above always pass. The first record let through after a suppressed run
+    carries the number of dropped records in its `suppressed` field.
+    """
+
+    def __init__(self, per_second: float = 5.0):
+        super().__init__()
+        self.per_second = per_second
+        self._windows = {} # key -> [window_start, passed_in_window, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'sample', None)
+        if key is None or record.levelno >= logging.WARNING or self.per_second <= 0: return True
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= 1.0:
+            suppressed = window[2] if window else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed: record.suppressed = suppressed
+            return True
+        if window[1] < self.per_second:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+def configure_logging(level=None, fmt: str = None, sample_per_second: float = None):
+    """Routes all logging through a QueueHandler -> QueueListener(stderr) pipeline. Safe to call more than once.
+
+    LOG_LEVEL, LOG_FORMAT ('json' or 'text') and LOG_SAMPLE_PER_SECOND env vars supply the defaults.
+    """
+    global _listener
+    if _listener is not None: return
+    level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+    fmt = (fmt or os.getenv('LOG_FORMAT', 'json')).lower()
+    sample_per_second = sample_per_second if sample_per_second is not None else float(os.getenv('LOG_SAMPLE_PER_SECOND', '5'))
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_per_second))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers): root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Flushes queued records; called automatically at exit."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,25 @@
+# media_groups.py
+import math
+
+def plan_media_groups(indexes: list, sizes: list, max_items: int, max_bytes: int = 0) -> list:
+    """Splits parts into albums of at most `max_items` and, if `max_bytes` is set, at most that many known bytes.
+
+    `sizes` runs parallel to `indexes` (None where unknown, counted as 0). Without a byte cap the parts are
+    spread evenly (11 -> 6 + 5, not 10 + 1), so no album degrades to a lone sendDocument.
+    """
+    if not max_bytes:
+        count = math.ceil(len(indexes) / max_items)
+        per_group, extra = divmod(len(indexes), count) if count else (0, 0)
+        groups, start = [], 0
+        for g in range(count):
+            end = start + per_group + (1 if g < extra else 0)
+            groups.append(indexes[start:end]); start = end
+        return groups
+    groups, current, current_bytes = [], [], 0
+    for index, size in zip(indexes, sizes):
+        size = size or 0
+        if current and (len(current) >= max_items or current_bytes + size > max_bytes):
+            groups.append(current); current, current_bytes = [], 0
+        current.append(index); current_bytes += size
+    if current: groups.append(current)
+    return groups
@@ -0,0 +1,68 @@
+# membership_cache.py
+import logging
+import time
+from collections import OrderedDict
+
+cache_logger = logging.getLogger("membership_cache")
+
+class MembershipCache:
+    """Bounded LRU cache of channel membership results.
+
+    Positive and negative answers get separate TTLs so a user who was "not a member"
+    is re-checked sooner than one who already joined. Entries are also overwritten
+    directly from ChatMemberUpdated updates, which keeps the cache honest between TTLs.
+    """
+
+    def __init__(self, max_size=10000, positive_ttl=600, negative_ttl=30, clock=time.monotonic):
+        self.max_size = max(1, int(max_size))
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._entries = OrderedDict() # user_id -> (is_member, expires_at), oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        """Returns the cached membership (True/False) or None on miss/expiry."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        is_member, expires_at = entry
+        if expires_at <= self._clock():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return is_member
+
+    def set(self, user_id, is_member: bool):
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        if ttl <= 0: self._entries.pop(user_id, None); return
+        self._entries[user_id] = (is_member, self._clock() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id):
+        if self._entries.pop(user_id, None) is not None: self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries), 'max_size': self.max_size,
+            'hits': self.hits, 'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions, 'invalidations': self.invalidations,
+        }
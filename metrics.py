@@ -0,0 +1,142 @@
+# metrics.py
+import bisect
+import functools
+import time
+
+from telegram.request import HTTPXRequest
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _fmt(value) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in self._values.items()]
+
+class Gauge(_Metric):
+    """Gauge whose value is read from `callback` at scrape time (or set explicitly)."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, callback=None):
+        super().__init__(name, help_text)
+        self.callback = callback
+        self._value = 0
+
+    def set(self, value: float):
+        self._value = value
+
+    def _samples(self):
+        try: value = self.callback() if self.callback else self._value
+        except Exception: return [] # A broken source shouldn't break the whole scrape
+        return [f"{self.name} {_fmt(value)}"]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None: series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets): series[i] += 1
+        series[-2] += value; series[-1] += 1
+
+    def _samples(self):
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _fmt(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics: raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()) -> Counter: return self._add(Counter(name, help_text, labelnames))
+    def gauge(self, name, help_text, callback=None) -> Gauge: return self._add(Gauge(name, help_text, callback))
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram: return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values(): lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+API_REQUEST_SECONDS = registry.histogram('bot_api_request_duration_seconds', 'Bot API call latency by method.', ('method',))
+API_REQUESTS = registry.counter('bot_api_requests_total', 'Bot API calls by method and HTTP status (0 = network error).', ('method', 'status'))
+HANDLER_SECONDS = registry.histogram('bot_handler_duration_seconds', 'Update handler latency.', ('handler',))
+
+def timed(handler_name: str):
+    """Decorator recording an async handler's latency in HANDLER_SECONDS."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try: return await func(*args, **kwargs)
+            finally: HANDLER_SECONDS.observe(time.perf_counter() - started, handler=handler_name)
+        return wrapper
+    return decorator
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call, so no timers are needed at call sites."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 0
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            return status, payload
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, method=api_method)
+            API_REQUESTS.inc(method=api_method, status=status)
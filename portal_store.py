@@ -0,0 +1,51 @@
+# portal_store.py
+import hashlib
+import json
+import sqlite3
+
+def content_hash(text: str, buttons) -> str:
+    """Stable hash of a portal page: its text plus the (label, url) pairs of its buttons."""
+    blob = json.dumps([text, [list(b) for b in buttons]], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+class PortalStore:
+    """Remembers which channel messages make up the portal, one row per (chat, page).
+
+    With the message_id and a hash of what was last rendered, the bot can edit its existing
+    portal in place and skip the API call entirely when nothing changed.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn # Owned by SQLiteBackend, like the other stores
+        self._conn.execute("BEGIN IMMEDIATE") # Workers start together; only one may migrate
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS portal_pages ("
+                " chat_id TEXT NOT NULL, page INTEGER NOT NULL, message_id INTEGER NOT NULL, content_hash TEXT NOT NULL,"
+                " PRIMARY KEY (chat_id, page))"
+            )
+            if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'portal_messages'").fetchone():
+                # The old table was keyed by page alone, so a second chat overwrote the first one's pages
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO portal_pages (chat_id, page, message_id, content_hash)"
+                    " SELECT chat_id, page, message_id, content_hash FROM portal_messages"
+                )
+                self._conn.execute("DROP TABLE portal_messages")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def pages(self, chat_id) -> dict:
+        """Returns {page: (message_id, content_hash)} for pages posted in `chat_id`."""
+        rows = self._conn.execute("SELECT page, message_id, content_hash FROM portal_pages WHERE chat_id = ?", (str(chat_id),))
+        return {page: (message_id, digest) for page, message_id, digest in rows}
+
+    def save(self, page: int, chat_id, message_id: int, digest: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO portal_pages (page, chat_id, message_id, content_hash) VALUES (?, ?, ?, ?)",
+            (page, str(chat_id), message_id, digest)
+        )
+
+    def remove(self, page: int, chat_id):
+        self._conn.execute("DELETE FROM portal_pages WHERE page = ? AND chat_id = ?", (page, str(chat_id)))
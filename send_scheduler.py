@@ -0,0 +1,210 @@
+# send_scheduler.py
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+
+scheduler_logger = logging.getLogger("send_scheduler")
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version/settings."""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+class TokenBucket:
+    """Classic token bucket. Costs above capacity are allowed once the bucket is full and leave it in debt."""
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self, cost: float = 1.0) -> float:
+        """Seconds until `cost` tokens can be taken (0 if now)."""
+        self._refill()
+        needed = min(cost, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1.0):
+        self._refill()
+        self.tokens -= cost
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class _Job:
+    __slots__ = ('method', 'args', 'kwargs', 'cost', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, method, args, kwargs, cost, future, enqueued_at):
+        self.method, self.args, self.kwargs, self.cost, self.future = method, args, kwargs, cost, future
+        self.enqueued_at = enqueued_at
+        self.attempts = 0
+
+class SendScheduler:
+    """Central outbound queue for Bot API calls.
+
+    Calls are queued per chat and dispatched round-robin across chats, so one long season
+    delivery can't starve other users. Each dispatch must pass a global token bucket (Telegram's
+    ~30 msg/s bot limit) and a per-chat bucket (~1 msg/s in private chats, 20 msg/min in groups
+    and channels). Calls within one chat run strictly in order. A RetryAfter pauses all
+    dispatching for the requested time and re-queues the call at the head of its chat.
+
+    Calls that don't target a chat (e.g. getFile) can use a tuple key such as ('getFile', 3):
+    each such key is an ordered lane that only passes the global bucket, so N lanes bound
+    that work to N calls in flight.
+    """
+
+    def __init__(self, global_rate=30.0, chat_rate=1.0, chat_burst=3, group_rate=20 / 60, group_burst=3, max_retries=3, clock=time.monotonic):
+        self._clock = clock
+        self._global = TokenBucket(global_rate, global_rate, clock)
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.group_rate, self.group_burst = group_rate, group_burst
+        self.max_retries = max_retries
+        self._queues = {} # chat_id -> deque[_Job]; only chats with pending calls
+        self._ring = deque() # round-robin order of chat_ids in _queues
+        self._buckets = {} # chat_id -> TokenBucket
+        self._busy = set() # chats with a call in flight
+        self._tasks = set() # strong refs to running calls
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher = None
+        self._last_prune = clock()
+        # Stats
+        self.dispatched = 0
+        self.retry_after_hits = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # --- Public API ---
+    async def call(self, chat_id, method, /, *args, cost: float = 1, **kwargs):
+        """Queues `await method(*args, **kwargs)` for `chat_id` and returns its result.
+
+        `cost` is charged against the global bucket (e.g. the number of items in a media group).
+        """
+        self.start()
+        job = _Job(method, args, kwargs, cost, asyncio.get_running_loop().create_future(), self._clock())
+        self._enqueue(chat_id, job)
+        return await job.future
+
+    def start(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch_loop(), name="send_scheduler")
+
+    async def stop(self):
+        if self._dispatcher and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            try: await self._dispatcher
+            except asyncio.CancelledError: pass
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done(): job.future.cancel()
+        self._queues.clear(); self._ring.clear()
+
+    def stats(self) -> dict:
+        waited = self.dispatched or 1
+        return {
+            'queue_depth': sum(len(q) for q in self._queues.values()),
+            'chats_waiting': len(self._queues), 'in_flight': len(self._busy),
+            'dispatched': self.dispatched, 'failed': self.failed, 'retry_after_hits': self.retry_after_hits,
+            'avg_wait_s': round(self.total_wait / waited, 4), 'max_wait_s': round(self.max_wait, 4),
+            'paused_for_s': round(max(0.0, self._paused_until - self._clock()), 2),
+        }
+
+    # --- Internals ---
+    def _bucket(self, chat_id):
+        """Per-chat bucket, or None for tuple lane keys that aren't chats."""
+        if isinstance(chat_id, tuple): return None
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0 # '@channel' usernames and negative ids are groups/channels
+            bucket = TokenBucket(self.group_rate, self.group_burst, self._clock) if is_group else TokenBucket(self.chat_rate, self.chat_burst, self._clock)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _enqueue(self, chat_id, job, front=False):
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            self._ring.append(chat_id)
+        if front: queue.appendleft(job)
+        else: queue.append(job)
+        self._wakeup.set()
+
+    def _dispatch_ready(self) -> float:
+        """Starts every call that may run now; returns seconds until the next one could (or None if idle)."""
+        now = self._clock()
+        if now < self._paused_until: return self._paused_until - now
+        next_wait = None
+        served = [] # chats that dispatched this pass go behind the ones still waiting
+        for _ in range(len(self._ring)):
+            chat_id = self._ring.popleft()
+            queue = self._queues[chat_id]
+            while queue and queue[0].future.done(): queue.popleft() # caller gave up
+            if not queue: del self._queues[chat_id]; continue
+            if chat_id not in self._busy:
+                job = queue[0]
+                bucket = self._bucket(chat_id)
+                wait = max(bucket.delay(1) if bucket else 0.0, self._global.delay(job.cost))
+                if wait <= 0:
+                    queue.popleft()
+                    if bucket: bucket.consume(1)
+                    self._global.consume(job.cost)
+                    self._busy.add(chat_id)
+                    task = asyncio.get_running_loop().create_task(self._run(chat_id, job))
+                    self._tasks.add(task); task.add_done_callback(self._tasks.discard)
+                    if queue: served.append(chat_id)
+                    else: del self._queues[chat_id]
+                    continue
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+            self._ring.append(chat_id)
+        self._ring.extend(served)
+        if now - self._last_prune > 60: self._prune_buckets(); self._last_prune = now
+        return next_wait
+
+    def _prune_buckets(self):
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._queues and c not in self._busy and b.is_full()]:
+            del self._buckets[chat_id]
+
+    async def _dispatch_loop(self):
+        while True:
+            self._wakeup.clear()
+            wait = self._dispatch_ready()
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError: pass
+
+    async def _run(self, chat_id, job):
+        waited = self._clock() - job.enqueued_at
+        self.dispatched += 1; self.total_wait += waited; self.max_wait = max(self.max_wait, waited)
+        try:
+            result = await job.method(*job.args, **job.kwargs)
+            if not job.future.done(): job.future.set_result(result)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            self.retry_after_hits += 1
+            self._paused_until = max(self._paused_until, self._clock() + delay)
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                self.failed += 1
+                scheduler_logger.error("Giving up on call for chat %s after %s flood waits.", chat_id, job.attempts, extra={'chat_id': chat_id})
+                if not job.future.done(): job.future.set_exception(e)
+            else:
+                scheduler_logger.warning("Flood control (retry_after=%ss) for chat %s; pausing sends and re-queueing.", delay, chat_id, extra={'chat_id': chat_id})
+                job.enqueued_at = self._clock()
+                self._enqueue(chat_id, job, front=True)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done(): job.future.set_exception(e)
+        finally:
+            self._busy.discard(chat_id)
+            self._wakeup.set()
@@ -0,0 +1,381 @@
+# state_backend.py
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from deletion_ledger import DeletionLedger
+from delivery_ledger import DeliveryLedger, PENDING, SENT
+from file_info_cache import FileInfo, FileInfoStore
+from portal_store import PortalStore
+
+backend_logger = logging.getLogger("state_backend")
+
+class SQLiteBackend:
+    """State shared between bot processes on one host, kept in the SQLite state DB.
+
+    Holds leases (leader election, per-delivery dedup), the shared membership cache, the
+    deletion schedule, the per-part delivery ledger, the portal pages and the file info
+    (via DeletionLedger, DeliveryLedger, PortalStore and FileInfoStore), and the per-shard
+    update queues. SQLite
+    can't block on an empty queue, so `pop_updates` polls every POLL_INTERVAL seconds
+    with a read-only check and only takes the write lock when there is something to pop.
+
+    sqlite3 calls block, so they run in a worker thread (one at a time) rather than on the
+    event loop; a short busy timeout turns lock contention into an error the caller handles.
+    """
+    POLL_INTERVAL = 0.05
+    BUSY_TIMEOUT = 2.0
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=self.BUSY_TIMEOUT)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # One connection for everything: the stores share its busy timeout, and _lock already serializes every call
+        self.deletions = DeletionLedger(self._conn)
+        self.deliveries = DeliveryLedger(self._conn)
+        self.portal = PortalStore(self._conn)
+        self.file_infos = FileInfoStore(self._conn)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_membership (user_id INTEGER PRIMARY KEY, is_member INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shard_updates (id INTEGER PRIMARY KEY AUTOINCREMENT, shard INTEGER NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_shard_updates_shard ON shard_updates (shard, id)")
+
+    async def _run(self, func, *args):
+        def locked():
+            with self._lock: return func(*args)
+        return await asyncio.to_thread(locked)
+
+    # --- Leases ---
+    def _acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        return self._conn.execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE"
+            " SET owner = excluded.owner, expires_at = excluded.expires_at WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (name, owner, now + ttl, now)
+        ).rowcount == 1
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Takes `name` if it is free or expired, or renews it if `owner` already holds it."""
+        return await self._run(self._acquire_lease, name, owner, ttl)
+
+    def _release_lease(self, name, owner, linger):
+        if linger > 0: self._conn.execute("UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?", (time.time() + linger, name, owner))
+        else: self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    async def release_lease(self, name: str, owner: str, linger: float = 0):
+        """Gives up `name`; with `linger` > 0 it stays taken (by `owner`) for that many more seconds."""
+        await self._run(self._release_lease, name, owner, linger)
+
+    # --- Membership ---
+    def _get_membership(self, user_id):
+        row = self._conn.execute(
+            "SELECT is_member FROM shared_membership WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+        ).fetchone()
+        return None if row is None else bool(row[0])
+
+    async def get_membership(self, user_id: int):
+        return await self._run(self._get_membership, user_id)
+
+    def _set_membership(self, user_id, is_member, ttl):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO shared_membership (user_id, is_member, expires_at) VALUES (?, ?, ?)",
+            (user_id, int(is_member), time.time() + ttl)
+        )
+
+    async def set_membership(self, user_id: int, is_member: bool, ttl: float):
+        await self._run(self._set_membership, user_id, is_member, ttl)
+
+    def _forget_membership(self, user_id):
+        self._conn.execute("DELETE FROM shared_membership WHERE user_id = ?", (user_id,))
+
+    async def forget_membership(self, user_id: int):
+        await self._run(self._forget_membership, user_id)
+
+    # --- Deletion schedule ---
+    async def schedule_deletions(self, chat_id: int, message_ids, delete_at: float):
+        await self._run(self.deletions.schedule, chat_id, message_ids, delete_at)
+
+    async def due_deletions(self, now: float = None, limit: int = 5000) -> dict:
+        return await self._run(self.deletions.due, now, limit)
+
+    async def remove_deletions(self, chat_id: int, message_ids):
+        await self._run(self.deletions.remove, chat_id, message_ids)
+
+    async def defer_deletions(self, chat_id: int, message_ids, delete_at: float, max_attempts: int = 5) -> int:
+        return await self._run(self.deletions.defer, chat_id, message_ids, delete_at, max_attempts)
+
+    async def pending_deletions(self, overdue_only: bool = False) -> int:
+        return await self._run(self.deletions.pending_count, overdue_only)
+
+    # --- Delivery ledger ---
+    async def missing_parts(self, user_id: int, content_key: str, file_ids, fresh_since: float) -> list:
+        return await self._run(self.deliveries.missing_parts, user_id, content_key, file_ids, fresh_since)
+
+    async def mark_parts(self, user_id: int, chat_id: int, content_key: str, parts, status: str):
+        await self._run(self.deliveries.mark, user_id, chat_id, content_key, list(parts), status)
+
+    async def unfinished_deliveries(self, since: float) -> list:
+        return await self._run(self.deliveries.unfinished, since)
+
+    async def prune_delivery_parts(self, before: float) -> int:
+        return await self._run(self.deliveries.prune, before)
+
+    # --- Portal pages ---
+    async def portal_pages(self, chat_id) -> dict:
+        return await self._run(self.portal.pages, chat_id)
+
+    async def save_portal_page(self, chat_id, page: int, message_id: int, digest: str):
+        await self._run(self.portal.save, page, chat_id, message_id, digest)
+
+    async def remove_portal_page(self, chat_id, page: int):
+        await self._run(self.portal.remove, page, chat_id)
+
+    # --- File info ---
+    async def load_file_info(self) -> dict:
+        return await self._run(self.file_infos.load)
+
+    async def save_file_info(self, file_id: str, info: FileInfo):
+        await self._run(self.file_infos.save, file_id, info)
+
+    # --- Shard queues ---
+    def _push_update(self, shard, payload):
+        self._conn.execute("INSERT INTO shard_updates (shard, payload) VALUES (?, ?)", (shard, payload))
+
+    async def push_update(self, shard: int, payload: str):
+        await self._run(self._push_update, shard, payload)
+
+    def _pop_updates(self, shard, limit):
+        # Plain SELECT first: an idle poll never takes the write lock. Each shard has a single consumer
+        # (the worker with that index), so the rows can't be taken by someone else before the DELETE.
+        rows = self._conn.execute("SELECT id, payload FROM shard_updates WHERE shard = ? ORDER BY id LIMIT ?", (shard, limit)).fetchall()
+        if rows: self._conn.execute(f"DELETE FROM shard_updates WHERE id IN ({','.join('?' * len(rows))})", [row_id for row_id, _ in rows])
+        return [payload for _, payload in rows]
+
+    async def pop_updates(self, shard: int, limit: int = 100, timeout: float = 1.0) -> list:
+        """Removes and returns up to `limit` queued payloads for `shard`, waiting up to `timeout` for the first one."""
+        deadline = time.monotonic() + timeout
+        while True:
+            payloads = await self._run(self._pop_updates, shard, limit)
+            if payloads or time.monotonic() >= deadline: return payloads
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def close(self):
+        await self._run(self._conn.close)
+
+_ACQUIRE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then redis.call('pexpire', KEYS[1], ARGV[2]) return 1 end
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then return 1 end
+return 0
+"""
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then return 0 end
+if tonumber(ARGV[2]) > 0 then redis.call('pexpire', KEYS[1], ARGV[2]) else redis.call('del', KEYS[1]) end
+return 1
+"""
+
+class RedisBackend:
+    """Same interface as SQLiteBackend on a Redis-compatible server, for processes spread over several hosts.
+
+    Needs the optional `redis` package (redis.asyncio). Deletions live in a sorted set scored by
+    delete_at, shard queues are lists consumed with BLPOP, leases are keys with a TTL. Each
+    (user, season) delivery is a hash of file_id -> [part, chat_id, status, updated_at], indexed
+    by a sorted set of last updates; portal pages and file info are hashes too.
+    """
+
+    def __init__(self, url: str, prefix: str = 'bot:'):
+        try: import redis.asyncio as aioredis
+        except ImportError as e: raise RuntimeError("STATE_BACKEND_URL points at Redis but the 'redis' package isn't installed (pip install redis).") from e
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._acquire = self._redis.register_script(_ACQUIRE_LUA)
+        self._release = self._redis.register_script(_RELEASE_LUA)
+        self._deletions_key = f"{prefix}deletions"
+        self._attempts_key = f"{prefix}deletion_attempts"
+        self._deliveries_key = f"{prefix}deliveries"
+        self._file_info_key = f"{prefix}file_info"
+
+    # --- Leases ---
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(await self._acquire(keys=[f"{self._prefix}lease:{name}"], args=[owner, int(ttl * 1000)]))
+
+    async def release_lease(self, name: str, owner: str, linger: float = 0):
+        await self._release(keys=[f"{self._prefix}lease:{name}"], args=[owner, int(linger * 1000)])
+
+    # --- Membership ---
+    async def get_membership(self, user_id: int):
+        value = await self._redis.get(f"{self._prefix}member:{user_id}")
+        return None if value is None else value == '1'
+
+    async def set_membership(self, user_id: int, is_member: bool, ttl: float):
+        await self._redis.set(f"{self._prefix}member:{user_id}", '1' if is_member else '0', px=int(ttl * 1000))
+
+    async def forget_membership(self, user_id: int):
+        await self._redis.delete(f"{self._prefix}member:{user_id}")
+
+    # --- Deletion schedule ---
+    @staticmethod
+    def _member(chat_id, message_id) -> str:
+        return f"{chat_id}:{message_id}"
+
+    async def schedule_deletions(self, chat_id: int, message_ids, delete_at: float):
+        mapping = {self._member(chat_id, mid): delete_at for mid in message_ids}
+        if mapping: await self._redis.zadd(self._deletions_key, mapping)
+
+    async def due_deletions(self, now: float = None, limit: int = 5000) -> dict:
+        members = await self._redis.zrangebyscore(self._deletions_key, '-inf', time.time() if now is None else now, start=0, num=limit)
+        grouped = {}
+        for member in members:
+            chat_id, _, message_id = member.rpartition(':')
+            grouped.setdefault(int(chat_id), []).append(int(message_id))
+        return grouped
+
+    async def remove_deletions(self, chat_id: int, message_ids):
+        members = [self._member(chat_id, mid) for mid in message_ids]
+        if not members: return
+        async with self._redis.pipeline(transaction=True) as pipe:
+            await pipe.zrem(self._deletions_key, *members).hdel(self._attempts_key, *members).execute()
+
+    async def defer_deletions(self, chat_id: int, message_ids, delete_at: float, max_attempts: int = 5) -> int:
+        members = [self._member(chat_id, mid) for mid in message_ids]
+        if not members: return 0
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for member in members: pipe.hincrby(self._attempts_key, member, 1)
+            attempts = await pipe.execute()
+        exhausted = [m for m, n in zip(members, attempts) if n >= max_attempts]
+        retry = {m: delete_at for m, n in zip(members, attempts) if n < max_attempts}
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if exhausted: pipe.zrem(self._deletions_key, *exhausted).hdel(self._attempts_key, *exhausted)
+            if retry: pipe.zadd(self._deletions_key, retry, xx=True)
+            await pipe.execute()
+        return len(exhausted)
+
+    async def pending_deletions(self, overdue_only: bool = False) -> int:
+        if overdue_only: return await self._redis.zcount(self._deletions_key, '-inf', time.time())
+        return await self._redis.zcard(self._deletions_key)
+
+    # --- Delivery ledger ---
+    def _parts_key(self, user_id, content_key) -> str:
+        return f"{self._prefix}parts:{user_id}:{content_key}"
+
+    async def missing_parts(self, user_id: int, content_key: str, file_ids, fresh_since: float) -> list:
+        rows = await self._redis.hgetall(self._parts_key(user_id, content_key))
+        delivered = set()
+        for fid, value in rows.items():
+            _, _, status, updated_at = json.loads(value)
+            if status == SENT and updated_at >= fresh_since: delivered.add(fid)
+        return [i for i, fid in enumerate(file_ids) if fid not in delivered]
+
+    async def mark_parts(self, user_id: int, chat_id: int, content_key: str, parts, status: str):
+        now = time.time()
+        mapping = {fid: json.dumps([index, chat_id, status, now]) for index, fid in parts}
+        if not mapping: return
+        async with self._redis.pipeline(transaction=True) as pipe:
+            await pipe.hset(self._parts_key(user_id, content_key), mapping=mapping).zadd(self._deliveries_key, {f"{user_id}:{content_key}": now}).execute()
+
+    async def unfinished_deliveries(self, since: float) -> list:
+        found = []
+        for member in await self._redis.zrangebyscore(self._deliveries_key, since, '+inf'):
+            user_id, _, content_key = member.partition(':')
+            for value in (await self._redis.hgetall(self._parts_key(user_id, content_key))).values():
+                _, chat_id, status, updated_at = json.loads(value)
+                if status == PENDING and updated_at >= since: found.append((int(user_id), chat_id, content_key)); break
+        return found
+
+    async def prune_delivery_parts(self, before: float) -> int:
+        """Drops whole deliveries last touched before `before`; returns how many."""
+        members = await self._redis.zrangebyscore(self._deliveries_key, '-inf', f"({before}")
+        if not members: return 0
+        async with self._redis.pipeline(transaction=True) as pipe:
+            keys = [self._parts_key(*member.split(':', 1)) for member in members]
+            await pipe.delete(*keys).zrem(self._deliveries_key, *members).execute()
+        return len(members)
+
+    # --- Portal pages ---
+    def _portal_key(self, chat_id) -> str:
+        return f"{self._prefix}portal:{chat_id}"
+
+    async def portal_pages(self, chat_id) -> dict:
+        rows = await self._redis.hgetall(self._portal_key(chat_id))
+        return {int(page): tuple(json.loads(value)) for page, value in rows.items()}
+
+    async def save_portal_page(self, chat_id, page: int, message_id: int, digest: str):
+        await self._redis.hset(self._portal_key(chat_id), str(page), json.dumps([message_id, digest]))
+
+    async def remove_portal_page(self, chat_id, page: int):
+        await self._redis.hdel(self._portal_key(chat_id), str(page))
+
+    # --- File info ---
+    async def load_file_info(self) -> dict:
+        rows = await self._redis.hgetall(self._file_info_key)
+        return {fid: FileInfo(*json.loads(value)) for fid, value in rows.items()}
+
+    async def save_file_info(self, file_id: str, info: FileInfo):
+        await self._redis.hset(self._file_info_key, file_id, json.dumps(list(info)))
+
+    # --- Shard queues ---
+    async def push_update(self, shard: int, payload: str):
+        await self._redis.rpush(f"{self._prefix}shard:{shard}", payload)
+
+    async def pop_updates(self, shard: int, limit: int = 100, timeout: float = 1.0) -> list:
+        key = f"{self._prefix}shard:{shard}"
+        first = await self._redis.blpop([key], timeout=timeout)
+        if first is None: return []
+        rest = await self._redis.lpop(key, limit - 1) if limit > 1 else None
+        return [first[1]] + (rest or [])
+
+    async def close(self):
+        await self._redis.aclose()
+
+def open_backend(url: str, sqlite_path: str):
+    """'' or 'sqlite:///path' -> SQLiteBackend (default: the state DB); 'redis://...' / 'rediss://...' -> RedisBackend."""
+    if url.startswith(('redis://', 'rediss://', 'unix://')): return RedisBackend(url)
+    if url.startswith('sqlite:///'): sqlite_path = url[len('sqlite:///'):]
+    elif url: raise ValueError(f"Unsupported STATE_BACKEND_URL '{url}' (expected sqlite:///path or redis://host:port/db).")
+    return SQLiteBackend(sqlite_path)
+
+class Lease:
+    """A named lease this process tries to hold, e.g. leadership for singleton jobs.
+
+    Call `refresh()` more often than `ttl`: it takes or renews the lease and updates `held`.
+    Backend errors count as not holding it, so two instances never both believe they lead.
+    """
+
+    def __init__(self, backend, name: str, owner: str, ttl: float):
+        self.backend, self.name, self.owner, self.ttl = backend, name, owner, ttl
+        self.held = False
+
+    async def refresh(self) -> bool:
+        try: held = await self.backend.acquire_lease(self.name, self.owner, self.ttl)
+        except Exception as e:
+            backend_logger.error("Lease '%s' refresh failed: %s", self.name, e, exc_info=True)
+            held = False
+        if held != self.held: backend_logger.info("%s %s lease '%s'.", self.owner, 'acquired' if held else 'lost', self.name)
+        self.held = held
+        return held
+
+    async def release(self):
+        if not self.held: return
+        self.held = False
+        try: await self.backend.release_lease(self.name, self.owner)
+        except Exception as e: backend_logger.warning("Could not release lease '%s': %s", self.name, e)
+
+class SoleLease:
+    """Stand-in for Lease when this process is the only instance: always held, no backend round trips."""
+
+    def __init__(self, name: str, owner: str):
+        self.name, self.owner = name, owner
+        self.held = True
+
+    async def refresh(self) -> bool:
+        return True
+
+    async def release(self):
+        pass
@@ -4,15 +4,39 @@
 
 # 1. Environment Variable Loading (MUST be at the very top)
 import os
-from dotenv import load_dotenv
-load_dotenv() # Loads .env file if present (for local testing), platform env vars take precedence
-
-# 2. Keep Alive Import
-from keep_alive import keep_alive # Assuming keep_alive.py is in the same directory
-
-# 3. Standard Imports
+import time
+BOOT_STARTED = time.perf_counter() # Start of the startup timing report
+DOTENV_PATH = next((p for p in (os.path.join(d, '.env') for d in (os.path.dirname(os.path.abspath(__file__)), os.getcwd())) if os.path.isfile(p)), None)
+if DOTENV_PATH:
+    from dotenv import load_dotenv # Only imported when there is a .env to load (local testing)
+    load_dotenv(DOTENV_PATH) # Exactly the file found above (bot dir first, then cwd); platform env vars take precedence
+
+# 2. Logging pipeline first, so every module logs through the queue
+from log_setup import configure_logging
+configure_logging()
+
+# 3. Project modules (keep_alive and its aiohttp import are loaded lazily in serve_application)
+from membership_cache import MembershipCache
+from send_scheduler import SendScheduler
+from state_backend import open_backend, Lease, SoleLease
+from delivery_ledger import PENDING, SENT, FAILED
+from catalog import Catalog
+from portal_store import content_hash
+from file_info_cache import FileInfoCache, format_size
+from delivery_coordinator import DeliveryCoordinator, STARTED, IN_FLIGHT
+from media_groups import plan_media_groups
+from metrics import registry, timed, InstrumentedRequest
+from cold_start import StartupTimer, SnapshotBot, load_snapshot, save_snapshot
+
+# 4. Standard Imports
 import logging
 import asyncio
+import importlib
+import json
+import math
+import secrets
+import signal
+import socket
 import re # For escaping markdown
 from telegram import (
     Update,
@@ -27,22 +51,26 @@ from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     ContextTypes,
     JobQueue,
     Defaults,
+    TypeHandler,
+    ApplicationHandlerStop,
 )
 from telegram.constants import ParseMode, ChatMemberStatus
-from telegram.error import TelegramError, Forbidden, BadRequest
+from telegram.error import TelegramError, Forbidden, BadRequest, InvalidToken
+from telegram.request import HTTPXRequest
+import httpx
 from telegram.helpers import escape_markdown # Import the escape_markdown helper
 
 # === Logging Setup ===
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("werkzeug").setLevel(logging.WARNING)
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+logging.getLogger("apscheduler").setLevel(logging.WARNING) # Per-run job logs every sweep interval
 logger = logging.getLogger(__name__)
+startup_timer = StartupTimer(BOOT_STARTED)
+startup_timer.mark('imports')
 
 # === Configuration ===
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -53,50 +81,173 @@ PUBLIC_CHANNEL_ID_STR = os.getenv('PUBLIC_CHANNEL_ID')
 try:
     PUBLIC_CHANNEL_ID = int(PUBLIC_CHANNEL_ID_STR) if PUBLIC_CHANNEL_ID_STR and PUBLIC_CHANNEL_ID_STR.startswith('-') else PUBLIC_CHANNEL_ID_STR
 except (ValueError, TypeError):
-    logger.error(f"PUBLIC_CHANNEL_ID ('{PUBLIC_CHANNEL_ID_STR}') is not valid. Bot might not function correctly.")
+    logger.error("PUBLIC_CHANNEL_ID ('%s') is not valid. Bot might not function correctly.", PUBLIC_CHANNEL_ID_STR)
     PUBLIC_CHANNEL_ID = None
 
 if not BOT_TOKEN: logger.critical("CRITICAL ERROR: BOT_TOKEN is not set.")
 if not BOT_USERNAME: logger.warning("WARNING: BOT_USERNAME is not set.")
 if not PUBLIC_CHANNEL_ID: logger.critical("CRITICAL ERROR: PUBLIC_CHANNEL_ID is not configured.")
 
-SEASONS = {
-    'apothecary_diaries_s1': [
-        'BQACAgQAAxkBAAEBEWhoImGp0GLWjLBTaJ90ZcIYtdFtvQACtSMAA1AZUQABXCxSF360SzYE', 'BQACAgQAAxkBAAEBEX9oInhdz1T_S7sJEifWD91VL5vO7QACzyMAA1AZUZ107KoTZlUXNgQ',
-        'BQACAgQAAxkBAAEBFY5oIyNYobHZHWWk2DJ2Hjkx99LgRAAC1CMAA1AZUdl6cVfp1NJENgQ', 'BQACAgQAAxkBAAEBFZRoIyPO_rPhGaOyzbrB9C1i0kVQFAAC2CMAA1AZUdTTQh9FDanpNgQ',
-        'BQACAgQAAxkBAAEBFZ5oIyRnTpQuMZmUL6G0WhoO5B4aTAAC7CMAA1AZUbD3Pqh5iI1gNgQ', 'BQACAgQAAxkBAAEBFaRoIyUvMwXAz9PJcwM1IppLokbTxwAC_iMAA1AZUa4d5x39FGS6NgQ',
-        'BQACAgQAAxkBAAEBFapoIyWcR6Le331xB_Hy3e3yyLuNlwAC_yMAA1AZUSGVkYFzvP5GNgQ', 'BQACAgQAAxkBAAEBFa5oIyXqcbLkpRD8H0JIea1iQcBN9QACASQAA1AZUQIF8Id9ze3tNgQ',
-        'BQACAgQAAxkBAAEBFbBoIyYNu-Oz0H_CmwSiouSiq2WESAACAyQAA1AZUZlu2B38psTBNgQ', 'BQACAgQAAxkBAAEBFbJoIyY5Y0wmYpBtM6pl9f4HNN6XzwACBSQAA1AZUeb9OVa0RYU1NgQ',
-        'BQACAgQAAxkBAAEBFbdoIyaq6xhaL0IQieSe4wakJd5WiQACBiQAA1AZUbUJS4dMKZIKNgQ', 'BQACAgQAAxkBAAEBFbloIybcbew4-C-ALKSiyYbX0LvZzQACByQAA1AZUcm08Upui6CaNgQ',
-        'BQACAgQAAxkBAAEBFcxoIyfdR-Q4uWTvvCYYJRK1vX129AACCCQAA1AZUUUV06vwTECfNgQ', 'BQACAgQAAxkBAAEBFcxoIyfdR-Q4uWTvvCYYJRK1vX129AACCCQAA1AZUUUV06vwTECfNgQ',
-        'BQACAgQAAxkBAAEBFdRoIyhfAWiiAUhdtrryj7NOjFW8pwACCiQAA1AZUfPBIAQINEVLNgQ', 'BQACAgQAAxkBAAEBFdhoIyiVNqJxHKEkceFyPylG5vH0ugACCyQAA1AZUat5zS5woEANNgQ',
-    ],
-    'another_series_s2': ['FILE_ID_S02E01', 'FILE_ID_S02E02'],
-}
-SEASONS_DISPLAY_NAMES = {
-    'apothecary_diaries_s1': "Apothecary Diaries (S1 Dual 1080p)",
-    'another_series_s2': "Another Series (Season 2)",
-}
 DELETE_AFTER_SECONDS = 20 * 60
 AUTO_SETUP_BUTTONS_ON_START = True
 
+# Update intake: 'polling' (getUpdates long-poll) or 'webhook' (Telegram POSTs to WEBHOOK_URL + WEBHOOK_PATH).
+# Both modes share one aiohttp server on the bot's event loop for '/' health and '/ready'.
+BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/') # Public base URL, e.g. https://my-bot.onrender.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram-webhook')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN') or secrets.token_urlsafe(32) # Random per process if unset
+
+# Content catalog (seasons -> file_ids) is loaded from JSON and hot-reloaded when the file changes.
+CATALOG_PATH = os.getenv('CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.json'))
+CATALOG_RELOAD_INTERVAL = int(os.getenv('CATALOG_RELOAD_INTERVAL', '30')) # 0 disables file watching
+PORTAL_BUTTONS_PER_MESSAGE = int(os.getenv('PORTAL_BUTTONS_PER_MESSAGE', '50')) # Telegram allows up to 100 buttons per message
+# File checks: catalog file_ids are validated with getFile (results cached in the state DB); known-bad parts are skipped.
+FILE_CHECK_ON_START = os.getenv('FILE_CHECK_ON_START', 'true').strip().lower() in ('1', 'true', 'yes')
+FILE_CHECK_CONCURRENCY = int(os.getenv('FILE_CHECK_CONCURRENCY', '8')) # getFile calls in flight at once
+ADMIN_USER_IDS = {int(uid) for uid in os.getenv('ADMIN_USER_IDS', '').replace(' ', '').split(',') if uid.isdigit()}
+
+# Persistent state (deletion ledger) lives next to the bot so it survives restarts.
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_state.sqlite3'))
+DELETION_SWEEP_INTERVAL = int(os.getenv('DELETION_SWEEP_INTERVAL', '30'))
+DELETE_MESSAGES_BATCH_SIZE = 100 # Bot API limit for deleteMessages
+DELETION_MAX_ATTEMPTS = 5
+
+# Scaling out: several processes share one state backend (SQLite state DB by default, or redis://...).
+# Worker 0 is the ingress (polls or receives the webhook) and forwards each update to the worker owning user_id % WORKER_COUNT.
+# Portal setup and the deletion sweeper only run on whichever instance holds the leader lease.
+STATE_BACKEND_URL = os.getenv('STATE_BACKEND_URL', '').strip()
+WORKER_COUNT = max(1, int(os.getenv('WORKER_COUNT', '1')))
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', '0'))
+IS_INGRESS = WORKER_INDEX == 0
+SOLE_INSTANCE = WORKER_COUNT == 1 and not STATE_BACKEND_URL # Nothing to elect: this process always leads
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{WORKER_INDEX}" # Stable across restarts, so a restarted leader keeps its lease
+LEADER_LEASE_TTL = int(os.getenv('LEADER_LEASE_TTL', '30'))
+DELIVERY_LEASE_TTL = 900 # Upper bound on one season delivery; frees the dedup lease if its process died
+
+# Membership cache: members are re-checked rarely, non-members quickly (they may be joining right now).
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', '10000'))
+MEMBERSHIP_POSITIVE_TTL = int(os.getenv('MEMBERSHIP_POSITIVE_TTL', '600'))
+MEMBERSHIP_NEGATIVE_TTL = int(os.getenv('MEMBERSHIP_NEGATIVE_TTL', '30'))
+MEMBER_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER, ChatMemberStatus.RESTRICTED)
+
+# Delivery: 'media_group' sends a season as albums of up to 10 documents, 'individual' sends one document per call.
+DELIVERY_MODE = os.getenv('DELIVERY_MODE', 'media_group').strip().lower()
+MEDIA_GROUP_MAX_SIZE = 10 # Bot API limit for sendMediaGroup
+MEDIA_GROUP_MAX_BYTES = int(os.getenv('MEDIA_GROUP_MAX_BYTES', '0')) # Optional cap on an album's total size (0 = item limit only)
+# Updates are handled concurrently; deliveries run as background tasks, one per (user, content_key) at a time.
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '32'))
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '64')) # Concurrent HTTP connections to the Bot API
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', '').rstrip('/') # e.g. a local Bot API server or bench/fake_bot_api.py
+DELIVERY_COOLDOWN_SECONDS = int(os.getenv('DELIVERY_COOLDOWN_SECONDS', '60'))
+# Per-part delivery ledger: re-requests only send what's missing, interrupted deliveries resume after a restart.
+DELIVERY_RESUME_MAX_AGE = int(os.getenv('DELIVERY_RESUME_MAX_AGE', '3600')) # 0 disables resuming on startup
+SENT_PART_MIN_LIFETIME = 120 # Parts due for auto-deletion within this many seconds are sent again rather than skipped
+
+# Outbound rate limits (Telegram: ~30 msg/s per bot, ~1 msg/s per private chat, 20 msg/min per group/channel).
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', str(30 / WORKER_COUNT))) # The bot-wide limit is split between workers
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_GROUP_RATE = float(os.getenv('SEND_GROUP_RATE', str(20 / 60)))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+STATS_LOG_INTERVAL = int(os.getenv('STATS_LOG_INTERVAL', '900')) # 0 disables
+# Cold start: bot identity and the parsed catalog are snapshotted (JSON) so the next boot can skip getMe and the catalog file read.
+STARTUP_SNAPSHOT_PATH = os.getenv('STARTUP_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(STATE_DB_PATH)), 'startup_snapshot.json'))
+
+membership_cache = MembershipCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_POSITIVE_TTL, MEMBERSHIP_NEGATIVE_TTL)
+send_scheduler = SendScheduler(SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE, max_retries=SEND_MAX_RETRIES)
+state_backend = open_backend(STATE_BACKEND_URL, STATE_DB_PATH)
+leader = SoleLease('leader', INSTANCE_ID) if SOLE_INSTANCE else Lease(state_backend, 'leader', INSTANCE_ID, LEADER_LEASE_TTL)
+delivery_coordinator = DeliveryCoordinator(DELIVERY_COOLDOWN_SECONDS)
+file_info = FileInfoCache() # In-memory mirror of the backend's file info, loaded in post_init
+portal_lock = asyncio.Lock()
+startup_snapshot = load_snapshot(STARTUP_SNAPSHOT_PATH, BOT_TOKEN) if BOT_TOKEN else {}
+catalog = Catalog(CATALOG_PATH, DELETE_AFTER_SECONDS // 60)
+snapshot_catalog = startup_snapshot.get('catalog') or {}
+if catalog.adopt(snapshot_catalog.get('raw'), snapshot_catalog.get('stamp')): logger.info("Catalog version %s served from the startup snapshot.", catalog.index.version)
+else: catalog.reload(force=True) # Snapshot missing or built from an older file
+if not catalog.index.entries: logger.critical("CRITICAL ERROR: Catalog at %s is empty or failed to load.", CATALOG_PATH)
+startup_timer.mark('state')
+
+# === Metrics (served at /metrics; Bot API calls are timed by InstrumentedRequest) ===
+STARTS = registry.counter('bot_starts_total', '/start commands received.')
+RETRIES = registry.counter('bot_retries_total', "'Try Again' taps received.")
+MEMBERSHIP_RESULTS = registry.counter('bot_membership_checks_total', 'Membership checks by result and source.', ('result', 'source'))
+FILES_SENT = registry.counter('bot_files_sent_total', 'Documents delivered.')
+FILES_FAILED = registry.counter('bot_files_failed_total', 'Documents that failed to deliver.')
+FILES_SKIPPED = registry.counter('bot_files_skipped_total', 'Parts not sent because their file_id is known to be invalid.')
+FILE_CHECKS = registry.counter('bot_file_checks_total', 'getFile validations by result.', ('result',))
+DELIVERIES_RESUMED = registry.counter('bot_deliveries_resumed_total', 'Interrupted deliveries resumed on startup.')
+DELETIONS = registry.counter('bot_deletions_total', 'Auto-deleted messages by outcome.', ('result',))
+STARTUP_SECONDS = registry.gauge('bot_startup_seconds', 'Seconds from process start to serving updates (see the startup report log).')
+UPDATES_FORWARDED = registry.counter('bot_updates_forwarded_total', "Updates handed to another worker's shard queue.")
+PENDING_DELETIONS = registry.gauge('bot_pending_deletions', 'Messages waiting in the deletion schedule (updated every sweep interval).')
+registry.gauge('bot_is_leader', '1 while this instance holds the leader lease.', lambda: int(leader.held))
+registry.gauge('bot_deliveries_in_flight', 'Season deliveries currently running.', lambda: delivery_coordinator.in_flight)
+registry.gauge('bot_send_queue_depth', 'Outbound calls waiting in the send scheduler.', lambda: send_scheduler.stats()['queue_depth'])
+registry.gauge('bot_membership_cache_size', 'Entries in the membership cache.', lambda: len(membership_cache))
+
 # === Helper Functions ===
-async def is_user_member_of_public_channel(bot: Bot, user_id: int) -> bool:
+async def remember_membership(user_id: int, is_member: bool):
+    """Caches a membership result locally and in the shared backend, with the TTL matching the result."""
+    membership_cache.set(user_id, is_member)
+    try: await state_backend.set_membership(user_id, is_member, MEMBERSHIP_POSITIVE_TTL if is_member else MEMBERSHIP_NEGATIVE_TTL)
+    except Exception as e: logger.warning("Could not share membership of %s: %s", user_id, e, extra={'user_id': user_id})
+
+async def forget_membership(user_id: int):
+    """Drops a cached membership result locally and in the shared backend."""
+    membership_cache.invalidate(user_id)
+    try: await state_backend.forget_membership(user_id)
+    except Exception as e: logger.warning("Could not drop shared membership of %s: %s", user_id, e, extra={'user_id': user_id})
+
+async def is_user_member_of_public_channel(bot: Bot, user_id: int, recheck_negative: bool = False):
+    """True/False, or None if Telegram couldn't be asked (flood limit, timeout, ...), which callers must not treat as "not a member".
+
+    With `recheck_negative` (the "I've Joined" button) a cached False is dropped and checked live; cached True still counts.
+    """
     if not PUBLIC_CHANNEL_ID: logger.error("is_user_member: PUBLIC_CHANNEL_ID not set."); return False
+    cached = membership_cache.get(user_id)
+    if cached is False and recheck_negative: await forget_membership(user_id); cached = None
+    if cached is not None:
+        MEMBERSHIP_RESULTS.inc(result='member' if cached else 'not_member', source='cache')
+        logger.debug("User %s membership: %s (cached).", user_id, cached, extra={'user_id': user_id})
+        return cached
+    try:
+        shared = await state_backend.get_membership(user_id) # Another worker (or a previous run) may have checked already
+        if shared is False and recheck_negative: await forget_membership(user_id)
+        elif shared is not None:
+            membership_cache.set(user_id, shared)
+            MEMBERSHIP_RESULTS.inc(result='member' if shared else 'not_member', source='shared')
+            return shared
+    except Exception as e: logger.warning("Shared membership lookup failed for %s: %s", user_id, e, extra={'user_id': user_id})
     try:
-        member = await bot.get_chat_member(chat_id=PUBLIC_CHANNEL_ID, user_id=user_id)
-        allowed = [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR, ChatMemberStatus.RESTRICTED]
-        is_member = member.status in allowed
-        logger.info(f"User {user_id} membership in {PUBLIC_CHANNEL_ID}: {is_member} (Status: {member.status}).")
+        started = time.perf_counter()
+        # Through the scheduler so a flood limit pauses and retries the check instead of failing it
+        member = await send_scheduler.call(('getChatMember', user_id), bot.get_chat_member, chat_id=PUBLIC_CHANNEL_ID, user_id=user_id)
+        is_member = member.status in MEMBER_STATUSES
+        await remember_membership(user_id, is_member)
+        MEMBERSHIP_RESULTS.inc(result='member' if is_member else 'not_member', source='api')
+        logger.info("User %s membership in %s: %s (Status: %s).", user_id, PUBLIC_CHANNEL_ID, is_member, member.status,
+                    extra={'user_id': user_id, 'latency_ms': round((time.perf_counter() - started) * 1000, 1)})
         return is_member
     except BadRequest as e:
         if "user not found" in str(e).lower() or "user_not_participant" in str(e).lower():
-            logger.info(f"User {user_id} not participant in {PUBLIC_CHANNEL_ID}.")
-        elif "chat not found" in str(e).lower():
-            logger.error(f"Public channel {PUBLIC_CHANNEL_ID} not found. Error: {e}")
-        else: logger.error(f"BadRequest checking membership for {user_id}: {e}", exc_info=True)
-        return False
-    except Exception as e: logger.error(f"Unexpected err checking membership {user_id}: {e}", exc_info=True); return False
+            await remember_membership(user_id, False)
+            MEMBERSHIP_RESULTS.inc(result='not_member', source='api')
+            logger.info("User %s not participant in %s.", user_id, PUBLIC_CHANNEL_ID, extra={'user_id': user_id})
+            return False
+        MEMBERSHIP_RESULTS.inc(result='error', source='api')
+        if "chat not found" in str(e).lower(): logger.error("Public channel %s not found. Error: %s", PUBLIC_CHANNEL_ID, e)
+        else: logger.error("BadRequest checking membership for %s: %s", user_id, e, exc_info=True, extra={'user_id': user_id})
+        return None
+    except Exception as e:
+        MEMBERSHIP_RESULTS.inc(result='error', source='api')
+        logger.error("Unexpected err checking membership %s: %s", user_id, e, exc_info=True, extra={'user_id': user_id}); return None
+
+def is_public_channel(chat) -> bool:
+    if not chat or not PUBLIC_CHANNEL_ID: return False
+    if isinstance(PUBLIC_CHANNEL_ID, int): return chat.id == PUBLIC_CHANNEL_ID
+    return bool(chat.username) and chat.username.lower() == str(PUBLIC_CHANNEL_ID).lstrip('@').lower()
 
 async def send_join_channel_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, requested_content_key: str):
     user_id = update.effective_user.id
@@ -110,9 +261,10 @@ async def send_join_channel_prompt(update: Update, context: ContextTypes.DEFAULT
              public_channel_link_text = f"our public channel (ID: {PUBLIC_CHANNEL_ID})" # Fallback if no bot username
     else: public_channel_link_text = "our public channel (config error)"
 
-    display_content_name = SEASONS_DISPLAY_NAMES.get(requested_content_key, requested_content_key.replace('_', ' ').title())
+    entry = catalog.get(requested_content_key)
+    escaped_name = entry.escaped_name if entry else escape_markdown(requested_content_key.replace('_', ' ').title(), version=2)
     text = (
-        f"👋 Hello\\! To access '{escape_markdown(display_content_name, version=2)}', "
+        f"👋 Hello\\! To access '{escaped_name}', "
         f"you need to join {public_channel_link_text}\\.\n\n"
         "Once joined, click 'Try Again' below\\."
     )
@@ -120,182 +272,662 @@ async def send_join_channel_prompt(update: Update, context: ContextTypes.DEFAULT
         InlineKeyboardButton("✅ I've Joined! Try Again.", callback_data=f"retry_{requested_content_key}")
     ]])
     try:
-        if update.callback_query: await update.callback_query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
-        elif update.message: await update.message.reply_text(text=text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
-        logger.info(f"Sent join prompt to user {user_id} for '{requested_content_key}'.")
-    except Exception as e: logger.error(f"Error sending join prompt to {user_id}: {e}", exc_info=True)
-
-async def send_files_to_user(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, content_key: str):
-    file_ids = SEASONS.get(content_key, [])
-    valid_file_ids = [fid for fid in file_ids if fid and not fid.startswith('FILE_ID_')]
-    display_content_name = SEASONS_DISPLAY_NAMES.get(content_key, content_key.replace('_', ' ').title())
-
-    if not valid_file_ids:
-        await context.bot.send_message(chat_id, f"🚧 Files for '{escape_markdown(display_content_name, version=2)}' not available yet\\.")
-        logger.warning(f"No valid files for '{content_key}' for {user_id}.")
-        return
+        if update.callback_query: await send_scheduler.call(update.effective_chat.id, update.callback_query.edit_message_text, text=text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
+        elif update.message: await send_scheduler.call(update.effective_chat.id, update.message.reply_text, text=text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
+        logger.info("Sent join prompt to user %s for '%s'.", user_id, requested_content_key, extra={'user_id': user_id, 'content_key': requested_content_key})
+    except Exception as e: logger.error("Error sending join prompt to %s: %s", user_id, e, exc_info=True, extra={'user_id': user_id, 'content_key': requested_content_key})
+
+async def schedule_auto_delete(chat_id: int, message_ids: list):
+    try: await state_backend.schedule_deletions(chat_id, message_ids, time.time() + DELETE_AFTER_SECONDS)
+    except Exception as e: logger.error("Failed to record auto-delete for %s in %s: %s", message_ids, chat_id, e, exc_info=True,
+                                   extra={'chat_id': chat_id, 'count': len(message_ids)})
+
+async def record_parts(status: str, user_id: int, chat_id: int, entry, indexes):
+    """Writes part statuses (PENDING/SENT/FAILED) to the delivery ledger."""
+    try: await state_backend.mark_parts(user_id, chat_id, entry.key, [(i, entry.file_ids[i]) for i in indexes], status)
+    except Exception as e: logger.error("Failed to record parts %s of '%s' for %s: %s", list(indexes), entry.key, user_id, e, exc_info=True,
+                                   extra={'user_id': user_id, 'chat_id': chat_id, 'content_key': entry.key})
+
+async def record_file_info(file_id: str, ok: bool, size: int = None, mime: str = None, error: str = None):
+    """Updates the in-memory file info and persists it to the backend if anything new was learned."""
+    info = file_info.record(file_id, ok, size, mime, error)
+    if not info: return
+    try: await state_backend.save_file_info(file_id, info)
+    except Exception as e: logger.warning("Could not store file info for %s...: %s", file_id[:16], e)
+
+async def load_file_info():
+    try: file_info.load(await state_backend.load_file_info())
+    except Exception as e: logger.error("Could not load file info from the state backend: %s", e, exc_info=True)
+
+async def remember_document(file_id: str, message):
+    """Caches size/mime from the Document Telegram echoes back, which works even for files too big for getFile."""
+    document = getattr(message, 'document', None)
+    if document is not None: await record_file_info(file_id, True, document.file_size, document.mime_type)
+
+def delivery_note(entry, indexes: list, skipped: int) -> str:
+    """Extra MarkdownV2 lines for the announcement: total size (when every part's size is cached) and skipped parts."""
+    lines = []
+    sizes = [file_info.size(entry.file_ids[i]) for i in indexes]
+    if sizes and all(size is not None for size in sizes): lines.append(f"📦 Total size: {escape_markdown(format_size(sum(sizes)), version=2)}")
+    if skipped: lines.append(f"🚧 {skipped} part\\(s\\) unavailable right now and skipped\\.")
+    return "".join(f"\n{line}" for line in lines)
+
+async def send_document_part(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, entry, index: int) -> bool:
+    try:
+        sent_message = await send_scheduler.call(chat_id, context.bot.send_document, chat_id=chat_id, document=entry.file_ids[index],
+            caption=entry.captions[index], parse_mode=None) # Plain-text captions: parse_mode=None overrides the MarkdownV2 default
+        logger.info("Sent Part %d for '%s' to %s (MsgID: %s).", entry.part_numbers[index], entry.key, user_id, sent_message.message_id,
+                    extra={'user_id': user_id, 'chat_id': chat_id, 'content_key': entry.key, 'sample': 'file_sent'})
+        await schedule_auto_delete(chat_id, [sent_message.message_id])
+        await record_parts(SENT, user_id, chat_id, entry, [index])
+        await remember_document(entry.file_ids[index], sent_message)
+        return True
+    except Exception as e:
+        logger.error("Err sending Part %d ('%s') to %s: %s", entry.part_numbers[index], entry.key, user_id, e, exc_info=True,
+                     extra={'user_id': user_id, 'chat_id': chat_id, 'content_key': entry.key})
+        await record_parts(FAILED, user_id, chat_id, entry, [index])
+        return False
 
-    await context.bot.send_message(chat_id,
-        f"✅ Great\\! Sending {len(valid_file_ids)} file\\(s\\) for '{escape_markdown(display_content_name, version=2)}'\\.\n\n"
-        f"🕒 _These files auto\\-delete in {DELETE_AFTER_SECONDS // 60} mins\\._", # Italic is with single underscores in MDv2
-        parse_mode=ParseMode.MARKDOWN_V2
+async def send_media_group_chunk(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, entry, indexes: list) -> list:
+    """Sends the given parts as one album; falls back to per-file sends if Telegram rejects it. Returns the indexes that failed."""
+    if len(indexes) == 1: # sendMediaGroup needs at least 2 items
+        return [] if await send_document_part(chat_id, user_id, context, entry, indexes[0]) else list(indexes)
+    media = [InputMediaDocument(media=entry.file_ids[i], caption=entry.captions[i], parse_mode=None) for i in indexes]
+    first, last = entry.part_numbers[indexes[0]], entry.part_numbers[indexes[-1]]
+    try:
+        sent_messages = await send_scheduler.call(chat_id, context.bot.send_media_group, chat_id=chat_id, media=media, cost=len(media))
+        await schedule_auto_delete(chat_id, [m.message_id for m in sent_messages])
+        await record_parts(SENT, user_id, chat_id, entry, indexes)
+        for index, message in zip(indexes, sent_messages): await remember_document(entry.file_ids[index], message)
+        logger.info("Sent Parts %d-%d for '%s' to %s as media group (%d msgs).", first, last, entry.key, user_id, len(sent_messages),
+                    extra={'user_id': user_id, 'chat_id': chat_id, 'content_key': entry.key, 'count': len(sent_messages), 'sample': 'file_sent'})
+        return []
+    except BadRequest as e: # Rejected outright (e.g. one bad file_id), so nothing arrived and single sends can't duplicate
+        logger.warning("Media group Parts %d-%d ('%s') to %s rejected, falling back to single sends: %s", first, last, entry.key, user_id, e,
+                       extra={'user_id': user_id, 'chat_id': chat_id, 'content_key': entry.key})
+    except Exception as e: # Forbidden/flood limit: single sends would fail too. TimedOut/NetworkError: the album may have arrived
+        logger.warning("Media group Parts %d-%d ('%s') to %s failed (%s), leaving them to the resume prompt: %s", first, last, entry.key, user_id,
+                       type(e).__name__, e, extra={'user_id': user_id, 'chat_id': chat_id, 'content_key': entry.key})
+        await record_parts(FAILED, user_id, chat_id, entry, indexes)
+        return list(indexes)
+    return [index for index in indexes if not await send_document_part(chat_id, user_id, context, entry, index)]
+
+async def send_remaining_prompt(chat_id: int, context: ContextTypes.DEFAULT_TYPE, entry, failed: int):
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("📥 Send remaining parts", callback_data=f"resume_{entry.key}")]])
+    await send_scheduler.call(chat_id, context.bot.send_message, chat_id,
+        f"⚠️ Error sending {failed} file\\(s\\)\\. Tap below to get the rest\\.", reply_markup=reply_markup)
+
+async def send_files_to_user(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, content_key: str) -> bool:
+    """Sends the parts of `content_key` the user doesn't already have. Returns False if some could not be sent."""
+    entry = catalog.get(content_key) # One snapshot for the whole delivery, even if the catalog reloads meanwhile
+    if entry is None: # Reloaded away between the tap and now; no cooldown for something that was never sent
+        await send_scheduler.call(chat_id, context.bot.send_message, chat_id, CONTENT_GONE_TEXT, parse_mode=None)
+        logger.warning("'%s' is no longer in the catalog; nothing sent to %s.", content_key, user_id, extra={'user_id': user_id, 'content_key': content_key})
+        return False
+    if not entry.file_ids:
+        await send_scheduler.call(chat_id, context.bot.send_message, chat_id, entry.unavailable_text)
+        logger.warning("No valid files for '%s' for %s.", content_key, user_id, extra={'user_id': user_id, 'content_key': content_key})
+        return True
+
+    total = len(entry.file_ids)
+    log_fields = {'user_id': user_id, 'chat_id': chat_id, 'content_key': content_key}
+    fresh_since = time.time() - DELETE_AFTER_SECONDS + SENT_PART_MIN_LIFETIME # Older parts are (about to be) auto-deleted
+    try: missing = await state_backend.missing_parts(user_id, content_key, entry.file_ids, fresh_since)
+    except Exception as e: # Without the ledger, send everything rather than nothing
+        logger.error("Delivery ledger read failed for '%s'/%s, sending all parts: %s", content_key, user_id, e, exc_info=True, extra=log_fields)
+        missing = list(range(total))
+    skipped = sum(1 for i in missing if file_info.is_bad(entry.file_ids[i])) # Known-bad file_ids would only fail again
+    available = total - skipped # Parts the user already has or gets now; "all of them" means these
+    if skipped:
+        missing = [i for i in missing if not file_info.is_bad(entry.file_ids[i])]
+        FILES_SKIPPED.inc(skipped)
+        logger.info("Skipping %d known-bad part(s) of '%s' for %s.", skipped, content_key, user_id, extra=dict(log_fields, sample='skipped_parts'))
+    if not missing:
+        text = entry.delivered_text(available) + delivery_note(entry, [], skipped) if available else entry.unavailable_text
+        await send_scheduler.call(chat_id, context.bot.send_message, chat_id, text)
+        logger.info("Nothing to send for '%s' to %s (%d skipped).", content_key, user_id, skipped, extra=log_fields)
+        return True
+
+    started = time.perf_counter()
+    await record_parts(PENDING, user_id, chat_id, entry, missing)
+    text = entry.announcement(len(missing)) if len(missing) == available else entry.remaining_text(len(missing), available)
+    text += delivery_note(entry, missing, skipped)
+    try: await send_scheduler.call(chat_id, context.bot.send_message, chat_id, text, parse_mode=ParseMode.MARKDOWN_V2)
+    except Exception as e: logger.warning("Could not announce '%s' to %s, sending files anyway: %s", content_key, user_id, e, extra=log_fields)
+    logger.info("Sending %d/%d files for '%s' to %s (mode: %s).", len(missing), total, content_key, user_id, DELIVERY_MODE, extra=log_fields)
+    failed = []
+    if DELIVERY_MODE == 'media_group':
+        sizes = [file_info.size(entry.file_ids[i]) for i in missing]
+        for group in plan_media_groups(missing, sizes, MEDIA_GROUP_MAX_SIZE, MEDIA_GROUP_MAX_BYTES):
+            failed += await send_media_group_chunk(chat_id, user_id, context, entry, group)
+    else:
+        failed = [index for index in missing if not await send_document_part(chat_id, user_id, context, entry, index)]
+    sent_count = len(missing) - len(failed)
+    FILES_SENT.inc(sent_count); FILES_FAILED.inc(len(failed))
+    log_fields['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    if failed:
+        logger.warning("Done '%s' for %s. Sent: %d, Failed: %d.", content_key, user_id, sent_count, len(failed), extra=log_fields)
+        await send_remaining_prompt(chat_id, context, entry, len(failed))
+        return False
+    logger.info("All %d for '%s' sent to %s.", sent_count, content_key, user_id, extra=log_fields)
+    return True
+
+CONTENT_GONE_TEXT = "😕 These files aren't available anymore. Use the buttons in the channel."
+MEMBERSHIP_UNKNOWN_TEXT = "⏳ Couldn't check your channel membership just now. Please try again in a moment."
+
+def delivery_busy_text(state: str, seconds_left: float) -> str:
+    if state == IN_FLIGHT: return "⏳ Already sending these files, hang on!"
+    return f"✅ Already sent, check the messages above. You can request them again in {math.ceil(seconds_left)}s."
+
+async def run_delivery(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, content_key: str):
+    """send_files_to_user under a shared lease, so two processes never deliver the same season to one user at once."""
+    lease_name = f"delivery:{user_id}:{content_key}"
+    try: acquired = await state_backend.acquire_lease(lease_name, INSTANCE_ID, DELIVERY_LEASE_TTL)
+    except Exception as e: # The per-part ledger still prevents most duplicates; don't drop the request
+        logger.warning("Delivery lease check failed, delivering anyway: %s", e, extra={'user_id': user_id, 'content_key': content_key})
+        acquired = True
+    if not acquired:
+        logger.info("Delivery of '%s' to %s is held by another instance, skipping.", content_key, user_id,
+                    extra={'user_id': user_id, 'content_key': content_key})
+        return None
+    completed = False
+    try:
+        completed = await send_files_to_user(chat_id, user_id, context, content_key)
+        return completed
+    finally: # A completed delivery keeps the lease through the cooldown, so other instances refuse repeats too
+        try: await state_backend.release_lease(lease_name, INSTANCE_ID, linger=DELIVERY_COOLDOWN_SECONDS if completed else 0)
+        except Exception as e: logger.warning("Could not release delivery lease %s (expires on its own): %s", lease_name, e)
+
+def start_delivery(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, content_key: str):
+    """Starts run_delivery in the background unless it's already running/cooling down. Returns (state, seconds_left)."""
+    return delivery_coordinator.launch(
+        (user_id, content_key), lambda: run_delivery(chat_id, user_id, context, content_key), context.application.create_task
     )
-    logger.info(f"Sending {len(valid_file_ids)} files for '{content_key}' to {user_id}.")
-    sent_count, failed_count = 0, 0
-    for index, file_id in enumerate(valid_file_ids):
-        try:
-            caption = f"{display_content_name} - Part {index + 1}" # Captions are plain text unless parse_mode is set
-            sent_message = await context.bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
-            sent_count += 1
-            logger.info(f"Sent Part {index+1} for '{content_key}' to {user_id} (MsgID: {sent_message.message_id}).")
-            context.job_queue.run_once(
-                delete_message_job, DELETE_AFTER_SECONDS,
-                {'chat_id': chat_id, 'message_id': sent_message.message_id},
-                name=f'del_{chat_id}_{sent_message.message_id}'
-            )
-            await asyncio.sleep(0.5)
-        except Exception as e:
-            failed_count += 1
-            logger.error(f"Err sending Part {index+1} ('{content_key}') to {user_id}: {e}", exc_info=True)
-            if failed_count == 1: await context.bot.send_message(chat_id, "⚠️ Error sending some files\\.")
-    if failed_count > 0: logger.warning(f"Done '{content_key}' for {user_id}. Sent: {sent_count}, Failed: {failed_count}.")
-    else: logger.info(f"All {sent_count} for '{content_key}' sent to {user_id}.")
 
 # === Telegram Handlers ===
+@timed('start_handler')
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    STARTS.inc()
     user = update.effective_user; chat_id = update.effective_chat.id
     if not all([BOT_TOKEN, BOT_USERNAME, PUBLIC_CHANNEL_ID]): # Check if essential configs are available
         logger.critical("start_handler: Essential bot config(s) missing.")
-        if update.message: await update.message.reply_text("Bot error. Admin needs to check config.")
+        if update.message: await send_scheduler.call(chat_id, update.message.reply_text, "Bot error. Admin needs to check config.")
         return
 
-    logger.info(f"/start: user={user.id}({user.full_name or 'N/A'}), chat={chat_id}, args={context.args}")
+    logger.info("/start: user=%s, chat=%s, args=%s", user.id, chat_id, context.args, extra={'user_id': user.id, 'chat_id': chat_id})
     if not context.args:
         pc_id_display = str(PUBLIC_CHANNEL_ID)
         if isinstance(PUBLIC_CHANNEL_ID, str) and PUBLIC_CHANNEL_ID.startswith('@'): pc_id_display = PUBLIC_CHANNEL_ID
-        await update.message.reply_text(f"Hello! 👋 Use buttons in {pc_id_display} for files.")
+        await send_scheduler.call(chat_id, update.message.reply_text, f"Hello! 👋 Use buttons in {pc_id_display} for files.")
         return
 
     req_key = context.args[0].lower()
-    if req_key not in SEASONS:
-        await update.message.reply_text("😕 Unrecognized request key. Use channel buttons.")
-        logger.warning(f"User {user.id} bad key: '{req_key}'.")
+    if req_key not in catalog:
+        await send_scheduler.call(chat_id, update.message.reply_text, "😕 Unrecognized request key. Use channel buttons.")
+        logger.warning("User %s bad key: '%s'.", user.id, req_key, extra={'user_id': user.id, 'chat_id': chat_id})
         return
 
-    is_member = await is_user_member_of_public_channel(context.bot, user.id)
-    if is_member: await send_files_to_user(chat_id, user.id, context, req_key)
-    else: await send_join_channel_prompt(update, context, req_key)
-
+    state, left = delivery_coordinator.status((user.id, req_key))
+    if state is None:
+        is_member = await is_user_member_of_public_channel(context.bot, user.id)
+        if is_member is None:
+            await send_scheduler.call(chat_id, update.message.reply_text, MEMBERSHIP_UNKNOWN_TEXT, parse_mode=None)
+            return
+        if not is_member:
+            await send_join_channel_prompt(update, context, req_key)
+            return
+        state, left = start_delivery(chat_id, user.id, context, req_key)
+    if state != STARTED:
+        logger.info("User %s repeat /start for '%s' (%s).", user.id, req_key, state, extra={'user_id': user.id, 'content_key': req_key})
+        await send_scheduler.call(chat_id, update.message.reply_text, delivery_busy_text(state, left), parse_mode=None)
+
+@timed('retry_handler')
 async def retry_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query; await query.answer()
-    user = query.effective_user; chat_id = query.effective_chat.id
+    RETRIES.inc()
+    query = update.callback_query
+    user = update.effective_user; chat_id = update.effective_chat.id
     try: action_type, req_key = query.data.split("_", 1)
     except ValueError: # Handles if query.data is not in "action_key" format
-        logger.warning(f"Invalid callback data '{query.data}' from user {user.id}")
-        await query.edit_message_text("Invalid request. Try buttons in the channel.")
+        await query.answer()
+        logger.warning("Invalid callback data '%s' from user %s", query.data, user.id, extra={'user_id': user.id, 'chat_id': chat_id})
+        await send_scheduler.call(chat_id, query.edit_message_text, "Invalid request. Try buttons in the channel.")
         return
 
-    if action_type != "retry": 
-        logger.warning(f"Unknown callback action '{action_type}' from {user.id}")
-        await query.edit_message_text("Unknown action. Try channel buttons.")
+    state, left = delivery_coordinator.status((user.id, req_key))
+    if state is not None: # Impatient re-tap: a toast is the cheapest possible answer
+        await query.answer(delivery_busy_text(state, left))
         return
+    await query.answer()
 
-    logger.info(f"User {user.id} 'Try Again' for '{req_key}'.")
-    is_member = await is_user_member_of_public_channel(context.bot, user.id)
-    if is_member:
-        try: await query.delete_message()
-        except Exception as e: logger.warning(f"Could not delete 'join' prompt: {e}")
-        await send_files_to_user(chat_id, user.id, context, req_key)
-    else: await send_join_channel_prompt(update, context, req_key) # Re-sends or edits the prompt
-
-async def delete_message_job(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job; chat_id = job.data['chat_id']; message_id = job.data['message_id']
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logger.info(f"Auto-deleted msg {message_id} from chat {chat_id}.")
-    except Forbidden: logger.warning(f"No permission to auto-delete {message_id} in {chat_id}.")
-    except BadRequest as e:
-        if "not found" in str(e).lower() or "invalid" in str(e).lower(): logger.info(f"Msg {message_id} in {chat_id} already deleted/invalid.")
-        else: logger.warning(f"BadRequest deleting {message_id} in {chat_id}: {e}")
-    except Exception as e: logger.error(f"Err auto-deleting {message_id} in {chat_id}: {e}", exc_info=True)
-
-async def setup_buttons(context: ContextTypes.DEFAULT_TYPE = None, bot: Bot = None):
-    if not bot and context: bot = context.bot
-    if not bot: logger.error("setup_buttons: Bot missing."); return
-    if not PUBLIC_CHANNEL_ID or not BOT_USERNAME: logger.error("setup_buttons: Config missing."); return
+    if action_type not in ("retry", "resume"):
+        logger.warning("Unknown callback action '%s' from %s", action_type, user.id, extra={'user_id': user.id, 'chat_id': chat_id})
+        await send_scheduler.call(chat_id, query.edit_message_text, "Unknown action. Try channel buttons.")
+        return
+    if req_key not in catalog: # Removed by a catalog reload since the prompt was sent
+        await send_scheduler.call(chat_id, query.edit_message_text, CONTENT_GONE_TEXT, parse_mode=None)
+        logger.warning("User %s '%s' for '%s', which is no longer in the catalog.", user.id, action_type, req_key,
+                       extra={'user_id': user.id, 'chat_id': chat_id, 'content_key': req_key})
+        return
 
-    keyboard = []
-    if not SEASONS: logger.warning("setup_buttons: SEASONS empty."); return
-    valid_keys = sorted([k for k, v in SEASONS.items() if any(fid and not fid.startswith('FILE_ID_') for fid in v)])
-    if not valid_keys: logger.warning("setup_buttons: No valid content."); return
+    logger.info("User %s '%s' for '%s'.", user.id, action_type, req_key, extra={'user_id': user.id, 'chat_id': chat_id, 'content_key': req_key})
+    is_member = await is_user_member_of_public_channel(context.bot, user.id, recheck_negative=True) # The tap means "I just joined"
+    if is_member is None: # Keep the prompt and its button for the next tap
+        await send_scheduler.call(chat_id, context.bot.send_message, chat_id, MEMBERSHIP_UNKNOWN_TEXT, parse_mode=None)
+    elif is_member:
+        state, left = start_delivery(chat_id, user.id, context, req_key)
+        if state != STARTED: return # Another tap won the race and is already sending
+        try: await send_scheduler.call(chat_id, query.delete_message) # The join/resume prompt has served its purpose
+        except Exception as e: logger.warning("Could not delete '%s' prompt: %s", action_type, e, extra={'user_id': user.id, 'chat_id': chat_id, 'content_key': req_key})
+    else: await send_join_channel_prompt(update, context, req_key) # Re-sends or edits the prompt
 
-    for key in valid_keys:
-        display_name = SEASONS_DISPLAY_NAMES.get(key, key.replace('_', ' ').title())
-        button_text = f"🎬 {display_name}"
-        button_url = f"https://t.me/{BOT_USERNAME}?start={key}"
-        keyboard.append([InlineKeyboardButton(button_text, url=button_url)])
+async def chat_member_update_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keeps the membership cache in sync with joins/leaves in the public channel (bot must be a channel admin)."""
+    change = update.chat_member
+    if not change or not is_public_channel(change.chat): return
+    user_id = change.new_chat_member.user.id
+    is_member = change.new_chat_member.status in MEMBER_STATUSES
+    membership_cache.invalidate(user_id)
+    await remember_membership(user_id, is_member)
+    logger.info("Membership update for %s in %s: %s -> %s.", user_id, PUBLIC_CHANNEL_ID, change.old_chat_member.status, change.new_chat_member.status,
+                extra={'user_id': user_id, 'sample': 'membership_update'})
+
+async def log_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    logger.info("Membership cache stats: %s", membership_cache.stats())
+    logger.info("Send scheduler stats: %s", send_scheduler.stats())
+    logger.info("Delivery stats: %s", delivery_coordinator.stats())
+    logger.info("Pending auto-deletions: %s (leader: %s)", await state_backend.pending_deletions(), leader.held)
+
+async def sweep_due_deletions(bot: Bot) -> int:
+    """Deletes every due message in the schedule, batched per chat via deleteMessages. Returns messages handled."""
+    due = await state_backend.due_deletions()
+    handled = 0
+    for chat_id, message_ids in due.items():
+        for start in range(0, len(message_ids), DELETE_MESSAGES_BATCH_SIZE):
+            batch = message_ids[start:start + DELETE_MESSAGES_BATCH_SIZE]
+            try:
+                await send_scheduler.call(chat_id, bot.delete_messages, chat_id=chat_id, message_ids=batch)
+                logger.info("Auto-deleted %d msg(s) from chat %s.", len(batch), chat_id, extra={'chat_id': chat_id, 'count': len(batch), 'sample': 'deleted'})
+                DELETIONS.inc(len(batch), result='deleted')
+            except Forbidden:
+                DELETIONS.inc(len(batch), result='dropped')
+                logger.warning("No permission to auto-delete %s msg(s) in %s.", len(batch), chat_id, extra={'chat_id': chat_id, 'count': len(batch)})
+            except BadRequest as e:
+                DELETIONS.inc(len(batch), result='dropped')
+                logger.warning("BadRequest deleting %s msg(s) in %s (dropping): %s", len(batch), chat_id, e, extra={'chat_id': chat_id, 'count': len(batch)})
+            except Exception as e:
+                dropped = await state_backend.defer_deletions(chat_id, batch, time.time() + DELETION_SWEEP_INTERVAL, DELETION_MAX_ATTEMPTS)
+                DELETIONS.inc(len(batch) - dropped, result='deferred'); DELETIONS.inc(dropped, result='dropped')
+                logger.error("Err auto-deleting %s msg(s) in %s, will retry (%s given up): %s", len(batch), chat_id, dropped, e, exc_info=True,
+                             extra={'chat_id': chat_id, 'count': len(batch)})
+                continue
+            await state_backend.remove_deletions(chat_id, batch)
+            handled += len(batch)
+    return handled
+
+async def deletion_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    if leader.held: # Only one instance sweeps the shared schedule
+        try: await sweep_due_deletions(context.bot)
+        except Exception as e: logger.error("Deletion sweep failed: %s", e, exc_info=True)
+    try: PENDING_DELETIONS.set(await state_backend.pending_deletions())
+    except Exception as e: logger.warning("Could not count pending deletions: %s", e)
+    try: await state_backend.prune_delivery_parts(time.time() - max(DELETE_AFTER_SECONDS, DELIVERY_RESUME_MAX_AGE)) # Rows past both horizons are useless
+    except Exception as e: logger.error("Delivery ledger prune failed: %s", e, exc_info=True)
+
+async def resume_deliveries_job(context: ContextTypes.DEFAULT_TYPE):
+    """Restarts deliveries a previous run left half-done (parts still 'pending' in the ledger)."""
+    try: unfinished = await state_backend.unfinished_deliveries(time.time() - DELIVERY_RESUME_MAX_AGE)
+    except Exception as e:
+        logger.error("Could not read unfinished deliveries: %s", e, exc_info=True)
+        return
+    for user_id, chat_id, content_key in unfinished:
+        if user_id % WORKER_COUNT != WORKER_INDEX: continue # Another worker owns this user
+        state, _ = start_delivery(chat_id, user_id, context, content_key)
+        if state == STARTED:
+            DELIVERIES_RESUMED.inc()
+            logger.info("Resuming delivery of '%s' to %s.", content_key, user_id, extra={'user_id': user_id, 'chat_id': chat_id, 'content_key': content_key})
+
+def render_portal_pages() -> list:
+    """Returns [(text, [(button_label, url), ...]), ...], one entry per portal message."""
+    index = catalog.index
+    buttons = [(index.entries[key].button_text, f"https://t.me/{BOT_USERNAME}?start={key}") for key in index.available_keys]
+    chunks = [buttons[i:i + PORTAL_BUTTONS_PER_MESSAGE] for i in range(0, len(buttons), PORTAL_BUTTONS_PER_MESSAGE)]
 
-    if not keyboard: logger.error("setup_buttons: Keyboard gen failed."); return
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     # Using MarkdownV2 - ensure BOT_USERNAME is escaped if it contains special chars
-    # The telegram.helpers.escape_markdown function is useful here.
     safe_bot_username = escape_markdown(BOT_USERNAME, version=2) if BOT_USERNAME else "the bot"
-    
-    text = (
+    header = (
         "✨ *File Portal Updated\\!* ✨\n\n"
         "Select content below\\.\n"
         "📢 _You must be a member of this channel to receive files\\._\n" # Italic uses single _ in MDv2
         f"Files are sent via @{safe_bot_username} and auto\\-delete after {DELETE_AFTER_SECONDS // 60} mins\\."
     ) # Note: MarkdownV2 requires escaping of ., !, -, etc.
-      # For a more complex message, pre-escape all special characters or use HTML.
-      # The text above has been simplified and basic escapes added.
-
-    try:
-        await bot.send_message(
-            chat_id=PUBLIC_CHANNEL_ID, text=text, reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True
-        )
-        logger.info(f"Button message sent/updated in {PUBLIC_CHANNEL_ID}.")
-    except Exception as e:
-        logger.error(f"Failed to send button message to {PUBLIC_CHANNEL_ID}: {e}", exc_info=True)
-        # If it's a parsing error, log the problematic text
-        if "parse" in str(e).lower():
-            logger.error(f"Problematic text for MarkdownV2 was likely: {text}")
+    pages = []
+    for number, chunk in enumerate(chunks, 1):
+        text = header if number == 1 else f"📂 *More content* \\({number}/{len(chunks)}\\)"
+        pages.append((text, chunk))
+    return pages
 
+async def setup_buttons(context: ContextTypes.DEFAULT_TYPE = None, bot: Bot = None):
+    """Brings the channel portal in line with the catalog: edits changed pages in place, posts missing ones,
+    deletes surplus ones and makes no API call for pages whose rendered content is unchanged."""
+    if not bot and context: bot = context.bot
+    if not bot: logger.error("setup_buttons: Bot missing."); return
+    if not PUBLIC_CHANNEL_ID or not BOT_USERNAME: logger.error("setup_buttons: Config missing."); return
+    if not catalog.index.entries: logger.warning("setup_buttons: Catalog empty."); return
+    if not catalog.index.available_keys: logger.warning("setup_buttons: No valid content."); return
+    if not leader.held: logger.info("setup_buttons: Not the leader, leaving the portal to it."); return
+
+    async with portal_lock:
+        pages = render_portal_pages()
+        try: stored = await state_backend.portal_pages(PUBLIC_CHANNEL_ID)
+        except Exception as e: logger.error("setup_buttons: Could not read stored portal pages, not touching the portal: %s", e, exc_info=True); return
+        sent, edited, unchanged = 0, 0, 0
+        for page, (text, buttons) in enumerate(pages):
+            digest = content_hash(text, buttons)
+            reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(label, url=url)] for label, url in buttons])
+            message_id, old_digest = stored.get(page, (None, None))
+            if message_id and old_digest == digest: unchanged += 1; continue
+            try:
+                if message_id:
+                    try:
+                        await send_scheduler.call(
+                            PUBLIC_CHANNEL_ID, bot.edit_message_text, chat_id=PUBLIC_CHANNEL_ID, message_id=message_id, text=text,
+                            reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True
+                        )
+                        await state_backend.save_portal_page(PUBLIC_CHANNEL_ID, page, message_id, digest); edited += 1
+                        continue
+                    except BadRequest as e:
+                        if "not modified" in str(e).lower():
+                            await state_backend.save_portal_page(PUBLIC_CHANNEL_ID, page, message_id, digest); unchanged += 1
+                            continue
+                        logger.warning("Portal page %s (msg %s) can't be edited, re-posting: %s", page + 1, message_id, e, extra={'chat_id': PUBLIC_CHANNEL_ID})
+                message = await send_scheduler.call(
+                    PUBLIC_CHANNEL_ID, bot.send_message, chat_id=PUBLIC_CHANNEL_ID, text=text, reply_markup=reply_markup,
+                    parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True
+                )
+                await state_backend.save_portal_page(PUBLIC_CHANNEL_ID, page, message.message_id, digest); sent += 1
+            except Exception as e:
+                logger.error("Failed to publish portal page %s in %s: %s", page + 1, PUBLIC_CHANNEL_ID, e, exc_info=True, extra={'chat_id': PUBLIC_CHANNEL_ID})
+                # If it's a parsing error, log the problematic text
+                if "parse" in str(e).lower(): logger.error("Problematic text for MarkdownV2 was likely: %s", text)
+
+        for page, (message_id, _) in sorted(stored.items()):
+            if page < len(pages): continue
+            try: await send_scheduler.call(PUBLIC_CHANNEL_ID, bot.delete_message, chat_id=PUBLIC_CHANNEL_ID, message_id=message_id)
+            except Exception as e: logger.warning("Could not delete surplus portal page %s (msg %s): %s", page + 1, message_id, e, extra={'chat_id': PUBLIC_CHANNEL_ID})
+            await state_backend.remove_portal_page(PUBLIC_CHANNEL_ID, page)
+        logger.info("Portal in %s: %s page(s), %s posted, %s edited, %s unchanged.", PUBLIC_CHANNEL_ID, len(pages), sent, edited, unchanged,
+                    extra={'chat_id': PUBLIC_CHANNEL_ID, 'count': len(pages)})
 
 async def get_chat_id_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat; user = update.effective_user; chat_id = chat.id
     response_text = f"Chat ID: `{chat_id}`\nChat Type: `{chat.type}`" # Backticks are for MarkdownV1 code block
     if user: response_text += f"\nYour User ID: `{user.id}`"
-    logger.info(f"/chatid by {user.id if user else 'N/A'} in {chat_id} ({chat.type}).")
+    logger.info("/chatid by %s in %s (%s).", user.id if user else 'N/A', chat_id, chat.type, extra={'user_id': user.id if user else None, 'chat_id': chat_id})
     # For this simple message, let's try without parse_mode or use MarkdownV1 (default if not specified)
     # Or ensure any special chars in response_text are escaped if using MarkdownV2
-    await update.message.reply_text(response_text) # Defaults to no parse_mode or MDV1 depending on PTB default
+    await send_scheduler.call(chat_id, update.message.reply_text, response_text) # Defaults to no parse_mode or MDV1 depending on PTB default
+
+async def reload_catalog_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user; chat_id = update.effective_chat.id
+    if not user or user.id not in ADMIN_USER_IDS:
+        logger.warning("/reloadcatalog denied for %s.", user.id if user else 'N/A', extra={'user_id': user.id if user else None, 'chat_id': chat_id})
+        return
+    changed = catalog.reload(force=True)
+    if changed: await setup_buttons(bot=context.bot)
+    index = catalog.index
+    summary = f"Catalog version {index.version}: {len(index.entries)} entries, {len(index.available_keys)} available ({'reloaded' if changed else 'unchanged'})."
+    if index.duplicates: summary += "\n" + catalog_duplicates_summary(index)
+    logger.info("/reloadcatalog by %s: %s", user.id, summary, extra={'user_id': user.id, 'chat_id': chat_id})
+    await send_scheduler.call(chat_id, update.message.reply_text, summary, parse_mode=None)
+
+async def catalog_reload_job(context: ContextTypes.DEFAULT_TYPE):
+    if not leader.held and not SOLE_INSTANCE: await load_file_info() # The leader validates; pick up its results
+    if catalog.reload(): # Cheap stat() unless the file changed
+        await setup_buttons(bot=context.bot)
+        await report_catalog_duplicates(context.bot)
+        if leader.held and FILE_CHECK_ON_START: await validate_catalog_files(context.bot) # Only new file_ids get checked
+
+async def check_file(bot: Bot, file_id: str, lane: int) -> str:
+    """Validates one file_id with getFile and caches the outcome. Returns 'ok', 'bad' or 'error' (transient, not cached)."""
+    try:
+        tg_file = await send_scheduler.call(('getFile', lane), bot.get_file, file_id)
+        await record_file_info(file_id, True, tg_file.file_size)
+        return 'ok'
+    except BadRequest as e:
+        if "too big" in str(e).lower(): # Bot API won't serve >20 MB downloads, but the id itself is valid
+            await record_file_info(file_id, True)
+            return 'ok'
+        await record_file_info(file_id, False, error=str(e))
+        return 'bad'
+    except Exception as e:
+        logger.warning("getFile for %s... failed, will retry next check: %s", file_id[:16], e)
+        return 'error'
+
+async def validate_catalog_files(bot: Bot, recheck: bool = False) -> dict:
+    """Checks every distinct catalog file_id not already cached (all of them with `recheck`), FILE_CHECK_CONCURRENCY at a time.
+
+    Returns a report with counts, the bad parts as [(key, part_number, error)] and file_ids shared between seasons.
+    """
+    index = catalog.index
+    owners = {} # file_id -> [(key, part_number)]
+    for key, entry in index.entries.items():
+        for number, fid in zip(entry.part_numbers, entry.file_ids): owners.setdefault(fid, []).append((key, number))
+    to_check = list(owners) if recheck else file_info.unchecked(owners)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(check_file(bot, fid, n % max(1, FILE_CHECK_CONCURRENCY)) for n, fid in enumerate(to_check)))
+    counts = {'ok': 0, 'bad': 0, 'error': 0}
+    for result in results: counts[result] += 1; FILE_CHECKS.inc(result=result)
+    bad = file_info.bad()
+    report = {
+        'distinct': len(owners), 'checked': len(to_check), **counts,
+        'bad_parts': [(key, part, bad[fid]) for fid in owners if fid in bad for key, part in owners[fid]],
+        'shared': {fid: refs for fid, refs in owners.items() if len(refs) > 1},
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+    logger.info("File check: %s distinct file_id(s), checked %s in %ss (ok %s, bad %s, errors %s); %s part(s) known bad.",
+                len(owners), len(to_check), report['seconds'], counts['ok'], counts['bad'], counts['error'], len(report['bad_parts']),
+                extra={'count': len(to_check), 'latency_ms': report['seconds'] * 1000})
+    return report
+
+def file_check_summary(report: dict) -> str:
+    lines = [f"File check: {report['distinct']} distinct file_id(s), {report['checked']} checked in {report['seconds']}s "
+             f"(ok {report['ok']}, bad {report['bad']}, transient errors {report['error']})."]
+    if report['bad_parts']:
+        lines.append(f"⚠️ {len(report['bad_parts'])} part(s) are skipped until fixed:")
+        lines += [f"- {key} part {part}: {error}" for key, part, error in report['bad_parts'][:50]]
+    if report['shared']: lines.append(f"ℹ️ {len(report['shared'])} file_id(s) appear in more than one season.")
+    return "\n".join(lines)
+
+async def report_to_admins(bot: Bot, text: str):
+    for admin_id in ADMIN_USER_IDS:
+        try: await send_scheduler.call(admin_id, bot.send_message, admin_id, text, parse_mode=None)
+        except Exception as e: logger.warning("Could not report to admin %s: %s", admin_id, e, extra={'user_id': admin_id, 'chat_id': admin_id})
+
+def catalog_duplicates_summary(index) -> str:
+    lines = [f"⚠️ Catalog version {index.version}: {len(index.duplicates)} duplicate file_id(s) dropped; their part numbers are skipped:"]
+    lines += [f"- {key} part {number} repeats part {first}" for key, number, first in index.duplicates[:50]]
+    return "\n".join(lines)
+
+async def report_catalog_duplicates(bot: Bot):
+    index = catalog.index
+    if leader.held and index.duplicates: await report_to_admins(bot, catalog_duplicates_summary(index)) # Repeats on each start/reload until fixed
+
+async def file_check_job(context: ContextTypes.DEFAULT_TYPE):
+    if not leader.held: return
+    try: report = await validate_catalog_files(context.bot)
+    except Exception as e:
+        logger.error("Startup file check failed: %s", e, exc_info=True)
+        return
+    if report['bad_parts']: await report_to_admins(context.bot, file_check_summary(report)) # Repeats on each start until fixed
 
+async def check_files_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/checkfiles [all] (admins): validates unchecked catalog file_ids, or every one with 'all', and replies with the report."""
+    user = update.effective_user; chat_id = update.effective_chat.id
+    if not user or user.id not in ADMIN_USER_IDS:
+        logger.warning("/checkfiles denied for %s.", user.id if user else 'N/A', extra={'user_id': user.id if user else None, 'chat_id': chat_id})
+        return
+    recheck = bool(context.args) and context.args[0].lower() == 'all'
+    await send_scheduler.call(chat_id, update.message.reply_text, "Checking catalog files...", parse_mode=None)
+    report = await validate_catalog_files(context.bot, recheck=recheck)
+    await send_scheduler.call(chat_id, update.message.reply_text, file_check_summary(report), parse_mode=None)
+
+def update_shard(update: Update) -> int:
+    """Worker that owns `update`: keyed by the user it concerns, so one user's updates (and cache entries) stay on one worker."""
+    user = update.chat_member.new_chat_member.user if update.chat_member else update.effective_user
+    return user.id % WORKER_COUNT if user else 0
+
+async def shard_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Group -1 handler: hands updates owned by another worker to its shard queue and stops processing them here."""
+    shard = update_shard(update)
+    if shard == WORKER_INDEX: return
+    await state_backend.push_update(shard, json.dumps(update.to_dict()))
+    UPDATES_FORWARDED.inc()
+    raise ApplicationHandlerStop
+
+async def consume_shard_updates(application: Application):
+    """Feeds this worker's shard queue into the application until it stops."""
+    while application.running:
+        try: payloads = await state_backend.pop_updates(WORKER_INDEX, timeout=1.0)
+        except Exception as e:
+            logger.error("Shard %s queue read failed: %s", WORKER_INDEX, e, exc_info=True)
+            await asyncio.sleep(1); continue
+        for payload in payloads: await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+
+def schedule_leader_chores(application: Application):
+    """One-off singleton chores; run at startup and again whenever this instance becomes the leader."""
+    if AUTO_SETUP_BUTTONS_ON_START and PUBLIC_CHANNEL_ID and BOT_USERNAME:
+        application.job_queue.run_once(lambda ctx: setup_buttons(bot=application.bot), when=0) # In the background once serving
+    if FILE_CHECK_ON_START: application.job_queue.run_once(file_check_job, when=0) # Cached results are reused
+    application.job_queue.run_once(lambda ctx: report_catalog_duplicates(application.bot), when=0)
+
+async def leader_lease_job(context: ContextTypes.DEFAULT_TYPE):
+    was_leader = leader.held
+    if await leader.refresh() and not was_leader:
+        logger.info("Became the leader; running the portal sync and file check it skipped so far.")
+        schedule_leader_chores(context.application)
+
+async def refresh_snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    """Confirms a snapshot-served identity with a real getMe, then writes a fresh snapshot for the next cold start."""
+    if startup_snapshot.get('bot_user'):
+        try: bot_info = await context.bot.get_me() # The snapshot only answered initialize()'s call
+        except InvalidToken: logger.critical("CRITICAL: BOT_TOKEN was rejected by Telegram."); return
+        except Exception as e: logger.warning("Could not verify bot identity, keeping the snapshot: %s", e); return
+        if bot_info.username != startup_snapshot['bot_user'].get('username'):
+            logger.warning("Bot identity changed since the snapshot: now @%s.", bot_info.username)
+    write_startup_snapshot(context.bot)
+
+def write_startup_snapshot(bot: Bot):
+    try: bot_user = bot.bot.to_dict()
+    except RuntimeError: return # Bot never initialized; nothing worth caching
+    save_snapshot(STARTUP_SNAPSHOT_PATH, BOT_TOKEN, bot_user, catalog.index.raw, catalog.index.source_stamp)
 
 async def post_init_hook(application: Application):
     logger.info("Running post-init tasks...")
     if not all([BOT_TOKEN, BOT_USERNAME, PUBLIC_CHANNEL_ID]):
         logger.warning("post_init: Critical configs missing. Functionality may be impaired.")
-    try:
-        bot_info = await application.bot.get_me()
-        logger.info(f"Bot init: @{bot_info.username} (ID: {bot_info.id})")
-        if BOT_USERNAME and BOT_USERNAME != bot_info.username:
-             logger.warning(f"MISMATCH: Env BOT_USERNAME ('{BOT_USERNAME}') vs actual ('{bot_info.username}')!")
-    except Exception as e: logger.error(f"Failed bot info in post_init: {e}", exc_info=True)
+    bot_info = application.bot.bot # Filled by initialize(), from getMe or the startup snapshot
+    logger.info("Bot init: @%s (ID: %s)%s", bot_info.username, bot_info.id, ' from snapshot' if startup_snapshot.get('bot_user') else '')
+    if BOT_USERNAME and BOT_USERNAME != bot_info.username:
+         logger.warning("MISMATCH: Env BOT_USERNAME ('%s') vs actual ('%s')!", BOT_USERNAME, bot_info.username)
+    application.job_queue.run_once(refresh_snapshot_job, when=0)
+    await load_file_info()
+
+    await leader.refresh()
+    logger.info("post_init: Instance %s is worker %s/%s%s, leader: %s.", INSTANCE_ID, WORKER_INDEX, WORKER_COUNT, ' (ingress)' if IS_INGRESS else '', leader.held)
+    if not SOLE_INSTANCE:
+        application.job_queue.run_repeating(leader_lease_job, interval=max(1, LEADER_LEASE_TTL / 3), first=max(1, LEADER_LEASE_TTL / 3))
 
     if AUTO_SETUP_BUTTONS_ON_START:
-        if PUBLIC_CHANNEL_ID and BOT_USERNAME:
-             logger.info("post_init: Scheduling button setup...")
-             application.job_queue.run_once(lambda ctx: setup_buttons(bot=application.bot), when=2)
+        if PUBLIC_CHANNEL_ID and BOT_USERNAME: logger.info("post_init: Scheduling button setup...")
         else: logger.error("post_init: Cannot auto-setup buttons; config missing.")
     else: logger.info("post_init: Auto button setup disabled.")
 
+    send_scheduler.start()
+    schedule_leader_chores(application) # Each skips unless leader; leader_lease_job re-runs them on a later takeover
+    if DELIVERY_RESUME_MAX_AGE > 0: application.job_queue.run_once(resume_deliveries_job, when=0) # Runs once the app has started
+    if CATALOG_RELOAD_INTERVAL > 0:
+        application.job_queue.run_repeating(catalog_reload_job, interval=CATALOG_RELOAD_INTERVAL, first=CATALOG_RELOAD_INTERVAL)
+    application.job_queue.run_repeating(deletion_sweep_job, interval=DELETION_SWEEP_INTERVAL, first=0) # First run replays overdue deletions
+    if STATS_LOG_INTERVAL > 0:
+        application.job_queue.run_repeating(log_stats_job, interval=STATS_LOG_INTERVAL, first=STATS_LOG_INTERVAL)
+
+async def post_shutdown_hook(application: Application):
+    logger.info("Shutting down. Send scheduler stats: %s", send_scheduler.stats())
+    await send_scheduler.stop()
+    await leader.release() # Lets another instance take over singleton jobs right away
+    write_startup_snapshot(application.bot) # Picks up catalog reloads made while running
+    await state_backend.close()
+
 # === Main Bot Execution Function ===
+async def serve_application(application: Application, mode: str):
+    """Runs the bot and the web server on one event loop until SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError: pass # e.g. Windows; Ctrl+C still raises KeyboardInterrupt
+
+    async def enqueue_webhook_update(data: dict):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    async def set_webhook():
+        try:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET_TOKEN, allowed_updates=Update.ALL_TYPES
+            )
+            logger.info("Webhook set to %s%s.", WEBHOOK_URL, WEBHOOK_PATH)
+        except Exception as e: logger.error("Failed to set webhook: %s", e, exc_info=True)
+
+    # aiohttp is the heaviest import; it loads in a thread while the bot starts up and only blocks where it's needed
+    web_import = asyncio.ensure_future(asyncio.to_thread(importlib.import_module, 'keep_alive'))
+    async def start_web():
+        keep_alive = await web_import
+        is_ready = lambda: application.running and (mode == 'webhook' or not IS_INGRESS or application.updater.running)
+        web_app = keep_alive.build_web_app(
+            ready_check=is_ready,
+            webhook_path=WEBHOOK_PATH if mode == 'webhook' and IS_INGRESS else None,
+            webhook_secret=WEBHOOK_SECRET_TOKEN, on_update=enqueue_webhook_update, metrics_renderer=registry.render
+        )
+        runner = await keep_alive.start_web_server(web_app)
+        startup_timer.mark('web_server')
+        return runner
+
+    runner = None
+    try:
+        if mode == 'webhook' and IS_INGRESS: runner = await start_web() # Webhook deliveries need a listener before anything else
+        await application.initialize() # No getMe round trip when the identity comes from the startup snapshot
+        startup_timer.mark('initialize')
+        await post_init_hook(application) # Only run_polling/run_webhook call post_init themselves
+        startup_timer.mark('post_init')
+        await application.start() # Portal refresh, deletion replay, file checks etc. start here as background jobs
+        startup_timer.mark('start')
+        if not IS_INGRESS:
+            application.create_task(consume_shard_updates(application))
+            logger.info("Worker %s/%s consuming its shard queue.", WORKER_INDEX, WORKER_COUNT)
+        elif mode == 'webhook': application.create_task(set_webhook()) # Already listening; Telegram's side can catch up
+        else:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            logger.info("Telegram bot polling started.")
+        startup_timer.mark('ingress')
+        if runner is None: runner = await start_web()
+        STARTUP_SECONDS.set(round(startup_timer.total, 3))
+        logger.info(startup_timer.report())
+        await stop_event.wait()
+    finally:
+        logger.info("Stopping Telegram bot application...")
+        if application.updater and application.updater.running: await application.updater.stop()
+        if delivery_coordinator.in_flight: logger.info("Waiting for %s in-flight delivery(ies)...", delivery_coordinator.in_flight)
+        if application.running: await application.stop() # Also awaits tasks started via application.create_task
+        if runner: await runner.cleanup()
+        await post_shutdown_hook(application)
+        await application.shutdown()
+
 def run_telegram_bot_application():
     logger.info("Attempting to start Telegram bot application...")
     if not BOT_TOKEN: logger.critical("CRITICAL: BOT_TOKEN missing."); return
+    if BOT_MODE not in ('polling', 'webhook'): logger.critical("CRITICAL: Unknown BOT_MODE '%s'.", BOT_MODE); return
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL: logger.critical("CRITICAL: BOT_MODE=webhook needs WEBHOOK_URL."); return
+    if not 0 <= WORKER_INDEX < WORKER_COUNT: logger.critical("CRITICAL: WORKER_INDEX %s out of range for WORKER_COUNT %s.", WORKER_INDEX, WORKER_COUNT); return
 
     # Set default parse mode for the application if desired (e.g. MARKDOWN_V2)
     # Be mindful that all reply_text/send_message calls will use this unless overridden.
@@ -303,30 +935,45 @@ def run_telegram_bot_application():
     defaults = Defaults(parse_mode=ParseMode.MARKDOWN_V2) # CHANGED TO MARKDOWN_V2
     
     try:
-        application = (
+        api_urls = {'base_url': f"{BOT_API_BASE_URL}/bot", 'base_file_url': f"{BOT_API_BASE_URL}/file/bot"} if BOT_API_BASE_URL else {}
+        tls = {'verify': httpx.create_ssl_context()} # Both clients share one TLS context instead of loading the CA bundle twice
+        bot = SnapshotBot( # Builder options for token/request/defaults/base_url move here since we pass our own bot
+            token=BOT_TOKEN, defaults=defaults, **api_urls, # Apply default parse mode
+            request=InstrumentedRequest(connection_pool_size=BOT_API_POOL_SIZE, httpx_kwargs=tls), # Times every Bot API call for /metrics
+            get_updates_request=HTTPXRequest(connection_pool_size=1, httpx_kwargs=tls),
+            cached_me=startup_snapshot.get('bot_user') # Skips the getMe round trip in initialize()
+        )
+        builder = (
             Application.builder()
-            .token(BOT_TOKEN)
-            .defaults(defaults) # Apply default parse mode
+            .bot(bot)
             .job_queue(JobQueue())
-            .post_init(post_init_hook)
-            .build()
+            .concurrent_updates(UPDATE_WORKERS) # Handlers only do cheap checks; deliveries run as background tasks
         )
+        if BOT_MODE == 'webhook' or not IS_INGRESS: builder = builder.updater(None) # Updates arrive through our web server or shard queue
+        application = builder.build()
     except Exception as e:
-        logger.critical(f"CRITICAL: Failed Telegram app build: {e}", exc_info=True)
+        logger.critical("CRITICAL: Failed Telegram app build: %s", e, exc_info=True)
         return
 
     logger.info("--- Bot Configuration Summary ---")
-    logger.info(f"Bot Username: @{BOT_USERNAME or 'N/A'}")
-    logger.info(f"Public Channel: {PUBLIC_CHANNEL_ID or 'N/A'}")
+    logger.info("Bot Username: @%s", BOT_USERNAME or 'N/A')
+    logger.info("Public Channel: %s", PUBLIC_CHANNEL_ID or 'N/A')
+    logger.info("Mode: %s", BOT_MODE)
+    logger.info("Worker: %s/%s (%s), state backend: %s", WORKER_INDEX, WORKER_COUNT, INSTANCE_ID, type(state_backend).__name__)
     # ... (other summary items) ...
 
+    if WORKER_COUNT > 1: application.add_handler(TypeHandler(Update, shard_router), group=-1)
     application.add_handler(CommandHandler("start", start_handler))
     application.add_handler(CommandHandler("chatid", get_chat_id_handler))
-    application.add_handler(CallbackQueryHandler(retry_handler, pattern=r"^retry_"))
+    application.add_handler(CommandHandler("reloadcatalog", reload_catalog_handler))
+    application.add_handler(CommandHandler("checkfiles", check_files_handler))
+    application.add_handler(CallbackQueryHandler(retry_handler, pattern=r"^(retry|resume)_"))
+    application.add_handler(ChatMemberHandler(chat_member_update_handler, ChatMemberHandler.CHAT_MEMBER))
+    startup_timer.mark('build')
 
-    logger.info("Starting Telegram bot polling...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
-    logger.info("Telegram bot polling stopped.")
+    logger.info("Starting Telegram bot (%s)...", BOT_MODE)
+    asyncio.run(serve_application(application, BOT_MODE))
+    logger.info("Telegram bot stopped.")
 
 # === Main Entry Point ===
 if __name__ == '__main__':
@@ -336,13 +983,7 @@ if __name__ == '__main__':
         # import sys; sys.exit(1) # Hard exit if criticals are missing
     else:
         logger.info("Essential configurations appear loaded.")
-        try:
-            keep_alive()
-            logger.info("Keep_alive server thread initiated.")
-        except Exception as e_ka:
-            logger.error(f"Could not start keep_alive: {e_ka}", exc_info=True)
-        
         try: run_telegram_bot_application()
         except KeyboardInterrupt: logger.info("Bot process stopped by user (Ctrl+C).")
-        except Exception as e_main: logger.critical(f"UNHANDLED EXCEPTION in main: {e_main}", exc_info=True)
+        except Exception as e_main: logger.critical("UNHANDLED EXCEPTION in main: %s", e_main, exc_info=True)
     logger.info("Script execution finished or bot stopped.")
@@ -0,0 +1,48 @@
+import pytest
+
+from catalog import build_index
+
+def build(seasons):
+    return build_index({'seasons': seasons}, delete_after_minutes=20)
+
+def test_drops_placeholders_blanks_and_non_strings():
+    index = build({'s1': {'display_name': 'Show', 'file_ids': ['FILE_ID_S01E01', 'a', '', '  ', None, 7, ' b ']}})
+    entry = index.entries['s1']
+    assert entry.file_ids == ('a', 'b')
+    assert entry.captions == ('Show - Part 1', 'Show - Part 2')
+
+def test_duplicate_keeps_source_part_numbers():
+    index = build({'s1': {'display_name': 'Show', 'file_ids': ['a', 'b', 'b', 'c', 'd']}})
+    entry = index.entries['s1']
+    assert entry.file_ids == ('a', 'b', 'c', 'd')
+    assert entry.part_numbers == (1, 2, 4, 5)
+    assert entry.captions[-2:] == ('Show - Part 4', 'Show - Part 5')
+    assert index.duplicates == [('s1', 3, 2)]
+
+def test_skips_invalid_keys_and_entries():
+    index = build({
+        'Good_Key': {'file_ids': ['a']},
+        'bad key': {'file_ids': ['b']},
+        'x' * 58: {'file_ids': ['c']},
+        'not_a_dict': ['d'],
+        'empty': {'file_ids': ['FILE_ID_X']},
+    })
+    assert set(index.entries) == {'good_key', 'empty'}
+    assert index.entries['good_key'].display_name == 'Good Key'
+    assert index.available_keys == ('good_key',)
+
+def test_rejects_catalog_without_seasons():
+    with pytest.raises(ValueError):
+        build_index({'files': {}}, 20)
+
+def test_version_follows_content():
+    assert build({'s1': {'file_ids': ['a']}}).version == build({'s1': {'file_ids': ['a']}}).version
+    assert build({'s1': {'file_ids': ['a']}}).version != build({'s1': {'file_ids': ['b']}}).version
+
+def test_announcements_count_sendable_parts():
+    entry = build({'s1': {'display_name': 'Show', 'file_ids': ['a', 'b', 'c']}}).entries['s1']
+    assert entry.announcement(3) is entry.announcement_text
+    assert "Sending 2 file" in entry.announcement(2)
+    assert "remaining 1 of 2 file" in entry.remaining_text(1, 2)
+    assert "all 2 file" in entry.delivered_text(2)
+    assert "all 3 file" in entry.delivered_text()
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from catalog import Catalog
+from cold_start import SNAPSHOT_VERSION, StartupTimer, load_snapshot, save_snapshot
+
+RAW = {'seasons': {'show_s1': {'display_name': 'Show', 'file_ids': ['a', 'b']}}}
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'test_bot'}
+
+def write_catalog(path, raw=RAW):
+    with open(path, 'w', encoding='utf-8') as f: json.dump(raw, f)
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    save_snapshot(path, 'token', BOT_USER, RAW, (1, 2))
+    snapshot = load_snapshot(path, 'token')
+    assert snapshot['bot_user'] == BOT_USER
+    assert snapshot['catalog'] == {'raw': RAW, 'stamp': [1, 2]}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+def test_snapshot_for_another_token_is_ignored(tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    save_snapshot(path, 'token', BOT_USER)
+    assert load_snapshot(path, 'other-token') == {}
+
+def test_missing_unreadable_or_old_snapshot_is_ignored(tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    assert load_snapshot(path, 'token') == {}
+    with open(path, 'w') as f: f.write('{not json')
+    assert load_snapshot(path, 'token') == {}
+    save_snapshot(path, 'token', BOT_USER)
+    with open(path) as f: snapshot = json.load(f)
+    snapshot['version'] = SNAPSHOT_VERSION - 1
+    with open(path, 'w') as f: json.dump(snapshot, f)
+    assert load_snapshot(path, 'token') == {}
+
+def test_adopt_rebuilds_the_index_when_the_stamp_matches(tmp_path):
+    path = str(tmp_path / 'catalog.json')
+    write_catalog(path)
+    catalog = Catalog(path, 20)
+    st = os.stat(path)
+    assert catalog.adopt(RAW, [st.st_mtime_ns, st.st_size]) # JSON turns the stamp tuple into a list
+    assert catalog.get('show_s1').file_ids == ('a', 'b')
+    assert not catalog.reload() # same stamp: nothing to re-read
+
+def test_adopt_rejects_a_stale_stamp(tmp_path):
+    path = str(tmp_path / 'catalog.json')
+    write_catalog(path)
+    st = os.stat(path)
+    catalog = Catalog(path, 20)
+    assert not catalog.adopt(RAW, [st.st_mtime_ns - 1, st.st_size])
+    assert not catalog.adopt(RAW, None)
+    assert not catalog.adopt(None, [st.st_mtime_ns, st.st_size])
+    assert catalog.index.entries == {}
+
+def test_adopt_rejects_invalid_data(tmp_path):
+    path = str(tmp_path / 'catalog.json')
+    write_catalog(path)
+    st = os.stat(path)
+    catalog = Catalog(path, 20)
+    assert not catalog.adopt({'files': []}, [st.st_mtime_ns, st.st_size])
+    assert not Catalog(str(tmp_path / 'missing.json'), 20).adopt(RAW, [0, 0])
+
+def test_startup_timer_reports_phases():
+    timer = StartupTimer()
+    timer.mark('config')
+    timer.mark('state')
+    assert [name for name, _ in timer.phases] == ['config', 'state']
+    assert timer.total == pytest.approx(sum(seconds for _, seconds in timer.phases))
+    assert timer.report().startswith("Startup: ready in ") and "(config " in timer.report()
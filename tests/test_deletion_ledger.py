@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+from deletion_ledger import DeletionLedger
+
+@pytest.fixture
+def ledger(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'state.sqlite3'), isolation_level=None)
+    yield DeletionLedger(conn)
+    conn.close()
+
+def test_due_groups_per_chat_in_due_order(ledger):
+    ledger.schedule(1, [10, 11], delete_at=100)
+    ledger.schedule(2, [20], delete_at=50)
+    ledger.schedule(1, [12], delete_at=300)
+    assert ledger.due(now=200) == {2: [20], 1: [10, 11]}
+    assert list(ledger.due(now=200)) == [2, 1]
+    assert ledger.due(now=200, limit=1) == {2: [20]}
+    ledger.remove(1, [10, 11])
+    assert ledger.due(now=200) == {2: [20]}
+
+def test_defer_counts_attempts_and_drops_at_max(ledger):
+    ledger.schedule(1, [10, 11], delete_at=100)
+    assert ledger.defer(1, [10, 11], delete_at=500, max_attempts=3) == 0
+    assert ledger.due(now=200) == {} # pushed back
+    assert ledger.defer(1, [10], delete_at=500, max_attempts=3) == 0
+    assert ledger.defer(1, [10, 11], delete_at=500, max_attempts=3) == 1 # third failure for 10, second for 11
+    assert ledger.due(now=600) == {1: [11]}
+    assert ledger.defer(1, [], delete_at=500) == 0
+
+def test_rescheduling_resets_attempts(ledger):
+    ledger.schedule(1, [10], delete_at=100)
+    ledger.defer(1, [10], delete_at=100, max_attempts=2)
+    ledger.schedule(1, [10], delete_at=100)
+    assert ledger.defer(1, [10], delete_at=100, max_attempts=2) == 0
+
+def test_pending_count(ledger):
+    ledger.schedule(1, [10], delete_at=0)
+    ledger.schedule(1, [11], delete_at=10 ** 12)
+    assert ledger.pending_count() == 2
+    assert ledger.pending_count(overdue_only=True) == 1
@@ -0,0 +1,62 @@
+import asyncio
+
+from delivery_coordinator import COOLDOWN, IN_FLIGHT, STARTED, DeliveryCoordinator
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_duplicate_requests_coalesce_while_in_flight(clock):
+    async def scenario():
+        coordinator = DeliveryCoordinator(cooldown=60, clock=clock)
+        release = asyncio.Event()
+        calls = []
+
+        async def deliver():
+            calls.append(1)
+            await release.wait()
+
+        assert coordinator.launch((1, 'key'), deliver) == (STARTED, 0.0)
+        assert coordinator.launch((1, 'key'), deliver) == (IN_FLIGHT, 0.0)
+        assert coordinator.launch((2, 'key'), deliver) == (STARTED, 0.0) # other users aren't affected
+        await asyncio.sleep(0)
+        assert coordinator.in_flight == 2
+        release.set()
+        await asyncio.sleep(0)
+        assert coordinator.in_flight == 0
+        assert len(calls) == 2
+        assert coordinator.stats()['coalesced'] == 1
+    run(scenario())
+
+def test_cooldown_after_completed_delivery(clock):
+    async def scenario():
+        coordinator = DeliveryCoordinator(cooldown=60, clock=clock)
+
+        async def deliver():
+            return True
+
+        coordinator.launch('key', deliver)
+        await asyncio.sleep(0)
+        clock.advance(15)
+        assert coordinator.launch('key', deliver) == (COOLDOWN, 45)
+        clock.advance(45)
+        assert coordinator.status('key') == (None, 0.0)
+        assert coordinator.launch('key', deliver) == (STARTED, 0.0)
+    run(scenario())
+
+def test_incomplete_or_failed_delivery_has_no_cooldown(clock):
+    async def scenario():
+        coordinator = DeliveryCoordinator(cooldown=60, clock=clock)
+
+        async def partial():
+            return False
+
+        async def broken():
+            raise RuntimeError("boom")
+
+        coordinator.launch('partial', partial)
+        coordinator.launch('broken', broken)
+        await asyncio.sleep(0)
+        assert coordinator.status('partial') == (None, 0.0)
+        assert coordinator.status('broken') == (None, 0.0)
+        assert coordinator.in_flight == 0
+    run(scenario())
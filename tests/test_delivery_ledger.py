@@ -0,0 +1,57 @@
+import sqlite3
+
+import pytest
+
+import delivery_ledger
+from delivery_ledger import FAILED, PENDING, SENT, DeliveryLedger
+
+@pytest.fixture
+def ledger(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'state.sqlite3'), isolation_level=None)
+    yield DeliveryLedger(conn)
+    conn.close()
+
+@pytest.fixture
+def now(monkeypatch):
+    """Pins the time.time() the ledger stamps rows with."""
+    current = [1000.0]
+    monkeypatch.setattr(delivery_ledger.time, 'time', lambda: current[0])
+    return current
+
+def test_missing_parts_honours_fresh_since(ledger, now):
+    file_ids = ('a', 'b', 'c')
+    ledger.mark(1, 100, 'show', [(0, 'a')], SENT)
+    now[0] = 2000.0
+    ledger.mark(1, 100, 'show', [(1, 'b')], SENT)
+    assert ledger.missing_parts(1, 'show', file_ids, fresh_since=500) == [2]
+    assert ledger.missing_parts(1, 'show', file_ids, fresh_since=1000) == [2] # the cutoff is inclusive
+    assert ledger.missing_parts(1, 'show', file_ids, fresh_since=1500) == [0, 2] # 'a' was (about to be) auto-deleted
+    assert ledger.missing_parts(2, 'show', file_ids, fresh_since=0) == [0, 1, 2]
+    assert ledger.missing_parts(1, 'other', file_ids, fresh_since=0) == [0, 1, 2]
+
+def test_parts_are_matched_by_file_id_not_position(ledger, now):
+    ledger.mark(1, 100, 'show', [(0, 'a'), (1, 'b')], SENT)
+    assert ledger.missing_parts(1, 'show', ('new', 'a', 'b'), fresh_since=0) == [0] # a part was inserted in the catalog
+
+def test_only_sent_parts_count(ledger, now):
+    ledger.mark(1, 100, 'show', [(0, 'a'), (1, 'b')], PENDING)
+    ledger.mark(1, 100, 'show', [(1, 'b')], FAILED)
+    assert ledger.missing_parts(1, 'show', ('a', 'b'), fresh_since=0) == [0, 1]
+
+def test_unfinished_lists_recent_pending_deliveries(ledger, now):
+    ledger.mark(1, 100, 'show', [(0, 'a'), (1, 'b')], PENDING)
+    ledger.mark(1, 100, 'show', [(0, 'a')], SENT)
+    ledger.mark(2, 200, 'show', [(0, 'a')], SENT)
+    now[0] = 500.0
+    ledger.mark(3, 300, 'old', [(0, 'x')], PENDING)
+    assert ledger.unfinished(since=900) == [(1, 100, 'show')]
+    assert sorted(ledger.unfinished(since=0)) == [(1, 100, 'show'), (3, 300, 'old')]
+    ledger.mark(1, 100, 'show', [(1, 'b')], SENT)
+    assert ledger.unfinished(since=900) == []
+
+def test_prune_drops_old_rows(ledger, now):
+    ledger.mark(1, 100, 'show', [(0, 'a')], SENT)
+    now[0] = 5000.0
+    ledger.mark(1, 100, 'show', [(1, 'b')], SENT)
+    assert ledger.prune(before=2000) == 1
+    assert ledger.missing_parts(1, 'show', ('a', 'b'), fresh_since=0) == [0]
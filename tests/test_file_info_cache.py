@@ -0,0 +1,39 @@
+import sqlite3
+
+from file_info_cache import FileInfoCache, FileInfoStore, format_size
+
+def test_record_merges_size_and_mime_with_earlier_info():
+    cache = FileInfoCache()
+    assert cache.record('a', True, size=2048) is not None
+    merged = cache.record('a', True, mime='video/mp4') # from a sent Document: mime, no size
+    assert (merged.size, merged.mime) == (2048, 'video/mp4')
+    assert cache.record('a', True) is None # nothing new
+    assert cache.record('a', True, size=2048, mime='video/mp4') is None
+    assert cache.size('a') == 2048
+
+def test_record_bad_then_ok_replaces_the_error():
+    cache = FileInfoCache()
+    cache.record('a', False, error='wrong file identifier')
+    assert cache.is_bad('a') and cache.bad() == {'a': 'wrong file identifier'}
+    info = cache.record('a', True, size=10)
+    assert info.ok and info.error is None
+    assert not cache.is_bad('a')
+
+def test_unchecked_and_load():
+    cache = FileInfoCache()
+    cache.record('a', True)
+    assert cache.unchecked(['a', 'b']) == ['b']
+    cache.load({})
+    assert len(cache) == 0
+
+def test_store_round_trip(tmp_path):
+    store = FileInfoStore(sqlite3.connect(str(tmp_path / "state.sqlite3"), isolation_level=None))
+    info = FileInfoCache().record('a', True, size=5, mime='video/mp4')
+    store.save('a', info)
+    assert store.load() == {'a': info}
+    store._conn.close()
+
+def test_format_size():
+    assert format_size(512) == '512 B'
+    assert format_size(1536) == '1.5 KB'
+    assert format_size(3 * 1024 ** 4) == '3072.0 GB'
@@ -0,0 +1,38 @@
+import json
+import logging
+
+import log_setup
+from log_setup import JsonFormatter, SamplingFilter
+
+def make_record(level=logging.INFO, **extra):
+    record = logging.LogRecord('bot', level, __file__, 1, 'sent %d parts', (3,), None)
+    record.__dict__.update(extra)
+    return record
+
+def test_sampling_counts_suppressed_records(clock, monkeypatch):
+    monkeypatch.setattr(log_setup.time, 'monotonic', clock)
+    sampler = SamplingFilter(per_second=2)
+    passed = [sampler.filter(make_record(sample='send')) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    clock.advance(1.0)
+    record = make_record(sample='send')
+    assert sampler.filter(record)
+    assert record.suppressed == 3
+    quiet = make_record(sample='send')
+    assert sampler.filter(quiet) and not hasattr(quiet, 'suppressed') # the count is reported once
+
+def test_sampling_is_per_key_and_skips_warnings(clock, monkeypatch):
+    monkeypatch.setattr(log_setup.time, 'monotonic', clock)
+    sampler = SamplingFilter(per_second=1)
+    assert sampler.filter(make_record(sample='a'))
+    assert not sampler.filter(make_record(sample='a'))
+    assert sampler.filter(make_record(sample='b'))
+    assert sampler.filter(make_record(logging.WARNING, sample='a'))
+    assert sampler.filter(make_record()) # untagged records are never sampled
+
+def test_json_formatter_merges_args_and_context_fields():
+    line = JsonFormatter().format(make_record(user_id=7, content_key='show', suppressed=2, sample='send'))
+    payload = json.loads(line)
+    assert payload['msg'] == 'sent 3 parts'
+    assert (payload['user_id'], payload['content_key'], payload['suppressed']) == (7, 'show', 2)
+    assert 'chat_id' not in payload and 'sample' not in payload
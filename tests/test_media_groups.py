@@ -0,0 +1,25 @@
+from media_groups import plan_media_groups
+
+def sizes_of(groups):
+    return [len(group) for group in groups]
+
+def test_spreads_parts_evenly_without_a_byte_cap():
+    assert plan_media_groups(list(range(11)), [None] * 11, 10) == [list(range(6)), list(range(6, 11))]
+    assert sizes_of(plan_media_groups(list(range(21)), [None] * 21, 10)) == [7, 7, 7]
+    assert sizes_of(plan_media_groups(list(range(10)), [None] * 10, 10)) == [10]
+    assert plan_media_groups([], [], 10) == []
+
+def test_keeps_the_given_indexes():
+    assert plan_media_groups([2, 5, 7], [None] * 3, 2) == [[2, 5], [7]]
+
+def test_byte_cap_closes_albums_early():
+    mb = 1024 ** 2
+    groups = plan_media_groups(list(range(5)), [40 * mb, 40 * mb, 30 * mb, 80 * mb, 10 * mb], 10, max_bytes=100 * mb)
+    assert groups == [[0, 1], [2], [3, 4]]
+
+def test_byte_cap_still_honours_the_item_limit_and_unknown_sizes():
+    assert sizes_of(plan_media_groups(list(range(12)), [1] * 12, 10, max_bytes=10 ** 9)) == [10, 2]
+    assert sizes_of(plan_media_groups(list(range(3)), [None, None, None], 10, max_bytes=1)) == [3] # unknown counts as 0
+
+def test_oversized_part_gets_its_own_album():
+    assert plan_media_groups([0, 1, 2], [5, 500, 5], 10, max_bytes=100) == [[0], [1], [2]]
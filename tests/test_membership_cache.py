@@ -0,0 +1,50 @@
+from membership_cache import MembershipCache
+
+def test_positive_and_negative_ttls(clock):
+    cache = MembershipCache(positive_ttl=600, negative_ttl=30, clock=clock)
+    cache.set(1, True)
+    cache.set(2, False)
+    assert cache.get(1) is True and cache.get(2) is False
+    clock.advance(30)
+    assert cache.get(2) is None # negative answers expire first
+    assert cache.get(1) is True
+    clock.advance(570)
+    assert cache.get(1) is None
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 2
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = MembershipCache(max_size=2, clock=clock)
+    cache.set(1, True)
+    cache.set(2, True)
+    cache.get(1) # 2 is now the oldest
+    cache.set(3, True)
+    assert cache.get(2) is None
+    assert cache.get(1) is True and cache.get(3) is True
+    assert cache.evictions == 1
+
+def test_overwrite_refreshes_ttl_and_verdict(clock):
+    cache = MembershipCache(positive_ttl=600, negative_ttl=30, clock=clock)
+    cache.set(1, False)
+    clock.advance(20)
+    cache.set(1, True) # e.g. from a chat_member update
+    clock.advance(20)
+    assert cache.get(1) is True
+
+def test_zero_ttl_is_not_cached(clock):
+    cache = MembershipCache(negative_ttl=0, clock=clock)
+    cache.set(1, True)
+    cache.set(1, False)
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+def test_invalidate_and_clear(clock):
+    cache = MembershipCache(clock=clock)
+    cache.set(1, True)
+    cache.set(2, True)
+    cache.invalidate(1)
+    cache.invalidate(1) # already gone, not counted
+    assert cache.get(1) is None
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.invalidations == 2
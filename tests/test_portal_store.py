@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+from portal_store import PortalStore, content_hash
+
+BUTTONS = [('🎬 Show S1', 'https://t.me/bot?start=show_s1'), ('🎬 Show S2', 'https://t.me/bot?start=show_s2')]
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'state.sqlite3'), isolation_level=None)
+    yield conn
+    conn.close()
+
+def test_content_hash_is_stable_and_sensitive():
+    digest = content_hash("Pick a season", BUTTONS)
+    assert content_hash("Pick a season", [tuple(b) for b in BUTTONS]) == digest
+    assert content_hash("Pick a season", [list(b) for b in BUTTONS]) == digest
+    assert content_hash("Pick a season!", BUTTONS) != digest
+    assert content_hash("Pick a season", BUTTONS[::-1]) != digest
+    assert content_hash("Pick a season", [(BUTTONS[0][0], 'https://t.me/bot?start=other')]) != content_hash("Pick a season", BUTTONS[:1])
+
+def test_unchanged_page_matches_stored_digest(conn):
+    store = PortalStore(conn)
+    store.save(0, '@chan', 11, content_hash("Page 1", BUTTONS))
+    message_id, digest = store.pages('@chan')[0]
+    assert message_id == 11
+    assert digest == content_hash("Page 1", BUTTONS) # setup_buttons skips the API call
+    assert digest != content_hash("Page 1", BUTTONS[:1])
+
+def test_pages_are_kept_per_chat(conn):
+    store = PortalStore(conn)
+    store.save(0, '@chan', 11, 'a')
+    store.save(1, '@chan', 12, 'b')
+    store.save(0, -100123, 99, 'c')
+    store.remove(1, '@chan')
+    assert store.pages('@chan') == {0: (11, 'a')}
+    assert store.pages(-100123) == {0: (99, 'c')}
+    store.save(0, '@chan', 13, 'd')
+    assert store.pages('@chan') == {0: (13, 'd')}
+
+def test_migrates_the_page_keyed_table(conn):
+    conn.execute("CREATE TABLE portal_messages (page INTEGER PRIMARY KEY, chat_id TEXT NOT NULL, message_id INTEGER NOT NULL, content_hash TEXT NOT NULL)")
+    conn.execute("INSERT INTO portal_messages VALUES (0, '@chan', 11, 'a'), (1, '@chan', 12, 'b')")
+    store = PortalStore(conn)
+    assert store.pages('@chan') == {0: (11, 'a'), 1: (12, 'b')}
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'portal_messages'").fetchone() is None
+    assert PortalStore(conn).pages('@chan') == {0: (11, 'a'), 1: (12, 'b')} # a second worker finds nothing to migrate
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+from send_scheduler import SendScheduler, TokenBucket
+
+def run(coro):
+    return asyncio.run(coro)
+
+def manual_scheduler(clock, **kwargs):
+    """A scheduler whose dispatch loop never starts; tests call pump() instead."""
+    scheduler = SendScheduler(clock=clock, **kwargs)
+    scheduler.start = lambda: None
+    return scheduler
+
+async def pump(scheduler):
+    """One dispatch pass, then let the started calls run to completion."""
+    wait = scheduler._dispatch_ready()
+    for _ in range(3): await asyncio.sleep(0)
+    return wait
+
+def recorder(log, label, result=None):
+    async def method():
+        log.append(label)
+        return result
+    return method
+
+# --- TokenBucket ---
+
+def test_bucket_starts_full_and_refills_at_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=4, clock=clock)
+    assert bucket.delay(4) == 0
+    bucket.consume(4)
+    assert bucket.delay(1) == pytest.approx(0.5)
+    clock.advance(0.5)
+    assert bucket.delay(1) == 0
+    clock.advance(100)
+    assert bucket.is_full()
+    assert bucket.tokens == 4 # capped at capacity
+
+def test_bucket_allows_oversized_cost_when_full_and_goes_into_debt(clock):
+    bucket = TokenBucket(rate=1, capacity=3, clock=clock)
+    assert bucket.delay(10) == 0 # a 10-item album only waits for a full bucket
+    bucket.consume(10)
+    assert bucket.tokens == -7
+    assert bucket.delay(1) == pytest.approx(8)
+
+# --- SendScheduler ---
+
+def test_round_robin_across_chats(clock):
+    async def scenario():
+        scheduler = manual_scheduler(clock, global_rate=1, chat_rate=100, chat_burst=100)
+        log = []
+        calls = [asyncio.ensure_future(scheduler.call(1, recorder(log, f"a{i}"))) for i in range(3)]
+        calls.append(asyncio.ensure_future(scheduler.call(2, recorder(log, "b0"))))
+        await asyncio.sleep(0)
+        for _ in range(4):
+            await pump(scheduler)
+            clock.advance(1)
+        await asyncio.gather(*calls)
+        assert log == ["a0", "b0", "a1", "a2"] # chat 2 isn't stuck behind chat 1's queue
+    run(scenario())
+
+def test_calls_within_a_chat_run_in_order_one_at_a_time(clock):
+    async def scenario():
+        scheduler = manual_scheduler(clock, chat_rate=100, chat_burst=100)
+        release = asyncio.Event()
+        log = []
+
+        async def slow():
+            log.append("first")
+            await release.wait()
+
+        first = asyncio.ensure_future(scheduler.call(1, slow))
+        second = asyncio.ensure_future(scheduler.call(1, recorder(log, "second")))
+        await asyncio.sleep(0)
+        await pump(scheduler)
+        await pump(scheduler)
+        assert log == ["first"] # chat is busy until the first call returns
+        release.set()
+        await first
+        await pump(scheduler)
+        await second
+        assert log == ["first", "second"]
+    run(scenario())
+
+def test_per_chat_bucket_spaces_out_private_and_group_chats(clock):
+    async def scenario():
+        scheduler = manual_scheduler(clock, chat_rate=1, chat_burst=1, group_rate=0.5, group_burst=1)
+        log = []
+        calls = [asyncio.ensure_future(scheduler.call(chat, recorder(log, f"{chat}:{i}"))) for chat in (7, -100) for i in range(2)]
+        await asyncio.sleep(0)
+        await pump(scheduler)
+        assert await pump(scheduler) == pytest.approx(1) # private chat refills first
+        assert log == ["7:0", "-100:0"]
+        clock.advance(1)
+        await pump(scheduler)
+        assert log == ["7:0", "-100:0", "7:1"]
+        clock.advance(1)
+        await pump(scheduler)
+        assert log[-1] == "-100:1"
+        await asyncio.gather(*calls)
+    run(scenario())
+
+def test_retry_after_pauses_and_requeues_at_head_of_chat(clock):
+    async def scenario():
+        scheduler = manual_scheduler(clock, chat_rate=100, chat_burst=100)
+        log = []
+        attempts = []
+
+        async def flooded():
+            attempts.append(clock())
+            if len(attempts) == 1: raise RetryAfter(5)
+            log.append("flooded")
+            return "ok"
+
+        first = asyncio.ensure_future(scheduler.call(1, flooded))
+        second = asyncio.ensure_future(scheduler.call(1, recorder(log, "second")))
+        other = asyncio.ensure_future(scheduler.call(2, recorder(log, "other")))
+        await asyncio.sleep(0)
+        await pump(scheduler)
+        assert log == ["other"]
+        assert scheduler.retry_after_hits == 1
+        assert await pump(scheduler) == pytest.approx(5) # everything is paused
+        assert log == ["other"]
+        clock.advance(5)
+        await pump(scheduler)
+        assert await first == "ok"
+        await pump(scheduler)
+        await second
+        assert log == ["other", "flooded", "second"]
+        assert attempts == [1000.0, 1005.0]
+        await other
+    run(scenario())
+
+def test_retry_after_gives_up_after_max_retries(clock):
+    async def scenario():
+        scheduler = manual_scheduler(clock, max_retries=1)
+
+        async def always_flooded():
+            raise RetryAfter(1)
+
+        call = asyncio.ensure_future(scheduler.call(1, always_flooded))
+        await asyncio.sleep(0)
+        await pump(scheduler)
+        clock.advance(1)
+        await pump(scheduler)
+        with pytest.raises(RetryAfter):
+            await call
+        assert scheduler.failed == 1
+        assert scheduler.stats()['queue_depth'] == 0
+    run(scenario())
+
+def test_cancelled_calls_are_skipped(clock):
+    async def scenario():
+        scheduler = manual_scheduler(clock)
+        log = []
+        abandoned = asyncio.ensure_future(scheduler.call(1, recorder(log, "abandoned")))
+        kept = asyncio.ensure_future(scheduler.call(1, recorder(log, "kept")))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        await pump(scheduler)
+        await kept
+        assert log == ["kept"]
+    run(scenario())
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+
+from delivery_ledger import FAILED, PENDING, SENT
+from file_info_cache import FileInfo
+from state_backend import RedisBackend, SQLiteBackend
+
+def make_sqlite(tmp_path, monkeypatch):
+    return SQLiteBackend(str(tmp_path / 'state.sqlite3'))
+
+def make_redis(tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa') # fakeredis needs it for the lease scripts
+    import redis.asyncio
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.asyncio, 'from_url', lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs))
+    return RedisBackend('redis://fake')
+
+@pytest.fixture(params=[make_sqlite, make_redis], ids=['sqlite', 'redis'])
+def run(request, tmp_path, monkeypatch):
+    """Runs `scenario(backend)` on a fresh backend of each kind, inside one event loop."""
+    factory = request.param
+    def runner(scenario):
+        async def main():
+            backend = factory(tmp_path, monkeypatch)
+            try: return await scenario(backend)
+            finally: await backend.close()
+        return asyncio.run(main())
+    return runner
+
+def test_lease_renewal_and_takeover_after_expiry(run):
+    async def scenario(backend):
+        assert await backend.acquire_lease('leader', 'a', ttl=0.2)
+        assert not await backend.acquire_lease('leader', 'b', ttl=0.2)
+        assert await backend.acquire_lease('leader', 'a', ttl=0.2) # renewal by the holder
+        await asyncio.sleep(0.3)
+        assert await backend.acquire_lease('leader', 'b', ttl=5) # expired, so anyone may take it
+        assert not await backend.acquire_lease('leader', 'a', ttl=5)
+    run(scenario)
+
+def test_lease_release_and_linger(run):
+    async def scenario(backend):
+        assert await backend.acquire_lease('delivery', 'a', ttl=5)
+        await backend.release_lease('delivery', 'b') # not the holder: no effect
+        assert not await backend.acquire_lease('delivery', 'b', ttl=5)
+        await backend.release_lease('delivery', 'a', linger=0.2)
+        assert not await backend.acquire_lease('delivery', 'b', ttl=5) # still taken during the linger
+        await asyncio.sleep(0.3)
+        assert await backend.acquire_lease('delivery', 'b', ttl=5)
+        await backend.release_lease('delivery', 'b')
+        assert await backend.acquire_lease('delivery', 'a', ttl=5)
+    run(scenario)
+
+def test_membership_expires_and_can_be_forgotten(run):
+    async def scenario(backend):
+        await backend.set_membership(1, False, ttl=30)
+        await backend.set_membership(2, True, ttl=0.1)
+        assert await backend.get_membership(1) is False
+        await asyncio.sleep(0.2)
+        assert await backend.get_membership(2) is None
+        await backend.forget_membership(1)
+        assert await backend.get_membership(1) is None
+    run(scenario)
+
+def test_shard_queue_is_fifo_per_shard(run):
+    async def scenario(backend):
+        for payload in ('a', 'b', 'c'): await backend.push_update(1, payload)
+        await backend.push_update(2, 'other')
+        assert await backend.pop_updates(1, limit=2, timeout=0.1) == ['a', 'b']
+        assert await backend.pop_updates(1, timeout=0.1) == ['c']
+        assert await backend.pop_updates(1, timeout=0.1) == []
+        assert await backend.pop_updates(2, timeout=0.1) == ['other']
+    run(scenario)
+
+def test_deletion_schedule(run):
+    async def scenario(backend):
+        now = time.time()
+        await backend.schedule_deletions(10, [1, 2], now - 1)
+        await backend.schedule_deletions(20, [3], now + 60)
+        assert await backend.due_deletions() == {10: [1, 2]}
+        assert await backend.pending_deletions() == 3
+        assert await backend.pending_deletions(overdue_only=True) == 2
+        assert await backend.defer_deletions(10, [1, 2], now - 1, max_attempts=2) == 0
+        assert await backend.defer_deletions(10, [1], now - 1, max_attempts=2) == 1 # second failure for 1
+        assert await backend.due_deletions() == {10: [2]}
+        await backend.remove_deletions(10, [2])
+        assert await backend.pending_deletions() == 1
+    run(scenario)
+
+def test_delivery_ledger(run):
+    async def scenario(backend):
+        file_ids = ('a', 'b', 'c')
+        await backend.mark_parts(1, 100, 'show', [(0, 'a'), (1, 'b'), (2, 'c')], PENDING)
+        await backend.mark_parts(1, 100, 'show', [(0, 'a')], SENT)
+        await backend.mark_parts(1, 100, 'show', [(2, 'c')], FAILED)
+        assert await backend.missing_parts(1, 'show', file_ids, time.time() - 60) == [1, 2]
+        assert await backend.missing_parts(1, 'show', file_ids, time.time() + 60) == [0, 1, 2] # 'a' is too old to count
+        assert await backend.missing_parts(2, 'show', file_ids, 0) == [0, 1, 2]
+        assert [tuple(row) for row in await backend.unfinished_deliveries(time.time() - 60)] == [(1, 100, 'show')]
+        await backend.mark_parts(1, 100, 'show', [(1, 'b')], SENT)
+        assert await backend.unfinished_deliveries(time.time() - 60) == []
+        assert await backend.prune_delivery_parts(time.time() + 1) >= 1
+        assert await backend.missing_parts(1, 'show', file_ids, 0) == [0, 1, 2]
+    run(scenario)
+
+def test_portal_pages_and_file_info(run):
+    async def scenario(backend):
+        await backend.save_portal_page('@chan', 0, 11, 'h0')
+        await backend.save_portal_page('@chan', 1, 12, 'h1')
+        await backend.save_portal_page('@other', 0, 99, 'x')
+        await backend.remove_portal_page('@chan', 1)
+        assert await backend.portal_pages('@chan') == {0: (11, 'h0')}
+        info = FileInfo(True, 2048, 'video/mp4', None, 1.5)
+        await backend.save_file_info('a', info)
+        assert await backend.load_file_info() == {'a': info}
+    run(scenario)